@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for generating configurations with many storages.
+
+This uses `pyperf <https://pyperf.readthedocs.io>`_, which is
+installed with the ``benchmark`` extra (``pip install -e .[benchmark]``).
+Results can be saved in machine-readable (JSON) form and compared
+between revisions::
+
+    $ python benchmarks/bench_recipes.py -o before.json
+    $ python benchmarks/bench_recipes.py -o after.json
+    $ python -m pyperf compare_to before.json after.json --table
+
+Pass ``--tracemalloc`` (or ``--track-memory``) to record peak memory
+usage instead of timings. Timings are reported per storage, so a
+recipe that scales linearly shows flat results across storage counts.
+The full matrix is large; use ``--fast``,
+``--counts``, ``--adapters``, ``--compress`` and ``--recipes`` to
+limit what runs.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+
+import pyperf
+
+from nti.recipes.zodb.tests import default_buildout
+from nti.recipes.zodb.relstorage import Databases as RelStorageDatabases
+from nti.recipes.zodb.zeo import Databases as ZEODatabases
+
+STORAGE_COUNTS = (1, 10, 100, 1000)
+ADAPTERS = ('mysql', 'postgresql', 'sqlite3')
+COMPRESS_MODES = ('none', 'decompress', 'compress')
+RECIPES = ('relstorage', 'zeo')
+
+
+def _storage_names(count):
+    return ' '.join('Storage_%d' % i for i in range(count))
+
+
+def _relstorage_options(count, adapter, compress, zodbconvert):
+    return {
+        'storages': _storage_names(count),
+        'sql_user': 'user',
+        'sql_passwd': 'passwd',
+        'sql_host': 'host',
+        'sql_adapter': adapter,
+        'compress': compress,
+        'write-zodbconvert': 'true' if zodbconvert else 'false',
+    }
+
+
+def _zeo_options(count, compress):
+    return {
+        'storages': _storage_names(count),
+        'compress': compress,
+        'pack-gc': 'true',
+    }
+
+
+def _bench_recipe(loops, recipe_factory, name, options):
+    # Each recipe mutates the buildout it is given, so every loop
+    # needs a fresh one. Creating that is not part of the timing.
+    total = 0
+    timer = pyperf.perf_counter
+    for _ in range(loops):
+        buildout = default_buildout()
+        opts = dict(options)
+        begin = timer()
+        recipe_factory(buildout, name, opts)
+        total += timer() - begin
+    return total
+
+
+def _add_cmdline_args(cmd, args):
+    for option in ('counts', 'adapters', 'compress', 'recipes'):
+        value = getattr(args, option)
+        if value:
+            cmd.extend(('--' + option, value))
+
+
+def _split(value, default, convert=str):
+    if not value:
+        return default
+    return tuple(convert(v) for v in value.split(','))
+
+
+def _remove_work_dir(orig_dir, work_dir):
+    # Step out first; not every platform can remove the current directory.
+    os.chdir(orig_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=_add_cmdline_args)
+    parser = runner.argparser
+    parser.add_argument('--counts',
+                        help='Comma separated storage counts. Default: %s'
+                        % ','.join(str(c) for c in STORAGE_COUNTS))
+    parser.add_argument('--adapters',
+                        help='Comma separated RelStorage adapters. Default: %s'
+                        % ','.join(ADAPTERS))
+    parser.add_argument('--compress',
+                        help='Comma separated compress modes. Default: %s'
+                        % ','.join(COMPRESS_MODES))
+    parser.add_argument('--recipes',
+                        help='Comma separated recipes. Default: %s'
+                        % ','.join(RECIPES))
+    args = runner.parse_args()
+
+    counts = _split(args.counts, STORAGE_COUNTS, int)
+    adapters = _split(args.adapters, ADAPTERS)
+    compress_modes = _split(args.compress, COMPRESS_MODES)
+    recipes = _split(args.recipes, RECIPES)
+
+    if args.worker:
+        # The buildout created for each run uses the current directory.
+        # Keep it from littering the checkout. Only do this in the
+        # workers; the manager needs relative paths (like the script
+        # and the output file) to keep working.
+        work_dir = tempfile.mkdtemp(prefix='nti.recipes.zodb-bench-')
+        atexit.register(_remove_work_dir, os.getcwd(), work_dir)
+        os.chdir(work_dir)
+
+    if 'relstorage' in recipes:
+        for count, adapter, compress, zodbconvert in itertools.product(
+                counts, adapters, compress_modes, (False, True)):
+            runner.bench_time_func(
+                'relstorage: %d storages %s compress=%s zodbconvert=%s' % (
+                    count, adapter, compress, zodbconvert
+                ),
+                _bench_recipe,
+                RelStorageDatabases,
+                'relstorages',
+                _relstorage_options(count, adapter, compress, zodbconvert),
+                inner_loops=count,
+            )
+
+    if 'zeo' in recipes:
+        for count, compress in itertools.product(counts, compress_modes):
+            runner.bench_time_func(
+                'zeo: %d storages compress=%s' % (count, compress),
+                _bench_recipe,
+                ZEODatabases,
+                'zeo',
+                _zeo_options(count, compress),
+                inner_loops=count,
+            )
+
+
+if __name__ == '__main__':
+    main()
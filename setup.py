@@ -5,13 +5,14 @@ from setuptools import setup, find_packages
 entry_points = {
     "zc.buildout" : [
         'relstorage = nti.recipes.zodb.relstorage:Databases',
-        'zeo = nti.recipes.zodb.zeo:Databases'
+        'zeo = nti.recipes.zodb.zeo:Databases',
+        'file = nti.recipes.zodb.files:File',
+        'manifest = nti.recipes.zodb.files:Manifest',
     ],
 }
 
 TESTS_REQUIRE = [
     'PyHamcrest',
-    'collective.recipe.template',
     'z3c.recipe.mkdir',
     'zope.testing',
     'zope.testrunner',
@@ -71,7 +72,10 @@ setup(
         'ZConfig', # zc.zodbrecipes also depends on this
     ],
     extras_require={
-        'test': TESTS_REQUIRE
+        'test': TESTS_REQUIRE,
+        'benchmark': [
+            'pyperf',
+        ],
     },
     entry_points=entry_points
 )
@@ -8,6 +8,11 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import re
+import sys
+from collections import OrderedDict
+
+from zc.buildout import UserError
 
 from ._model import ZConfigSection
 from ._model import Ref
@@ -15,6 +20,82 @@ from ._model import ChoiceRef
 from ._model import Part
 from ._model import Default
 from ._model import NoDefault
+from ._model import hyphenated
+
+def _option_true(value):
+    return value and value.lower() in ('1', 'yes', 'on', 'true')
+
+def _option_count(value, option):
+    # A whole number of at least one, for *option*.
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise UserError("%s must be a whole number of at least 1, not %r" % (option, value))
+    return count
+
+_STORAGE_RANGE = re.compile(r'\{(\d+)\.\.(\d+)\}')
+
+def expand_storage_names(value):
+    """
+    Expand the whitespace delimited storage names in *value*.
+
+    A name may include one numeric range, like ``Users_{1..64}``,
+    declaring the shards ``Users_1`` through ``Users_64``. If the
+    first number has leading zeros, all the numbers are padded to its
+    width (``{01..64}``).
+
+    Returns a list of ``(storage name, shard group)`` pairs. The shard
+    group is the declaration without the range and the separator
+    before it (``Users``), or None for names without a range.
+
+    A range that counts down, or more than one range in a name, is
+    an error.
+    """
+    result = []
+    for declaration in value.split():
+        matches = list(_STORAGE_RANGE.finditer(declaration))
+        if not matches:
+            result.append((declaration, None))
+            continue
+        if len(matches) > 1:
+            raise UserError("Storage %r declares more than one range" % (declaration,))
+        match = matches[0]
+        prefix = declaration[:match.start()]
+        suffix = declaration[match.end():]
+        group = (prefix.rstrip('_-') + suffix) or declaration
+        start, end = match.groups()
+        if int(start) > int(end):
+            raise UserError("Storage %r declares an empty range" % (declaration,))
+        width = len(start) if start.startswith('0') else 0
+        for i in range(int(start), int(end) + 1):
+            result.append(('%s%0*d%s' % (prefix, width, i, suffix), group))
+    return result
+
+_PACK_WINDOW = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+
+def pack_start_times(count, window):
+    """
+    Return ``(hour, minute)`` start times for *count* packs spread
+    evenly across *window*, a string like ``01:00-05:00``. The window
+    may span midnight (``23:00-03:00``); if it ends when it begins,
+    it is the whole day.
+
+    The first pack starts when the window opens.
+    """
+    match = _PACK_WINDOW.match(window.strip())
+    if match is None:
+        raise UserError("Invalid pack-window %r; use HH:MM-HH:MM" % (window,))
+    start_hour, start_minute, end_hour, end_minute = [int(x) for x in match.groups()]
+    if start_hour > 23 or end_hour > 23 or start_minute > 59 or end_minute > 59:
+        raise UserError("Invalid pack-window %r; use HH:MM-HH:MM" % (window,))
+    start = start_hour * 60 + start_minute
+    length = (end_hour * 60 + end_minute - start) % (24 * 60) or 24 * 60
+    return [
+        divmod((start + length * i // count) % (24 * 60), 60)
+        for i in range(count)
+    ]
 
 class MetaRecipe(object):
     # Contains the base methods that are required of a recipe,
@@ -52,8 +133,19 @@ class zodb(ZConfigSection):
     database_name = Ref('name').hyphenate()
     cache_size = Ref('cache-size').hyphenate()
 
-    def __init__(self, _name, storage):
-        ZConfigSection.__init__(self, 'zodb', _name, APPEND=storage)
+    #: Settings that are only written when some part sets them,
+    #: and ZODB's defaults for them.
+    _optional_settings = (
+        ('cache_size_bytes', 0),
+        ('large_record_size', '16MB'),
+        ('historical_pool_size', 3),
+        ('historical_cache_size', 1000),
+        ('historical_cache_size_bytes', 0),
+        ('historical_timeout', '5m'),
+    )
+
+    def __init__(self, _name, storage, **kwargs):
+        ZConfigSection.__init__(self, 'zodb', _name, APPEND=storage, **kwargs)
 
 class deployment(object):
     data = Ref('deployment', 'data-directory')
@@ -84,6 +176,23 @@ class MultiStorageRecipe(MetaRecipe):
     #   a configparser formatted file with ZODB uris for each
     #   configured database. This is the same information as ``zodb_conf.xml``,
     #   in a different format.
+    # * ``zodb_manifest`` creates ``/etc/zodb_manifest.json``, recording
+    #   a hash of each generated file and of the configuration of each
+    #   storage (and server), and which of them changed.
+
+    #: If true (the default) the parts we create are collected
+    #: and handed to buildout in a single call to its ``parse``
+    #: method by :meth:`parse_pending_parts`, which subclasses must
+    #: call at the end of ``__init__``. Buildout adds all the parsed
+    #: sections before it initializes any of them, so parts may refer
+    #: to parts created after them. Set this to false to parse each
+    #: part as it is created, which can be helpful when debugging.
+    #:
+    #: Buildout creates the sections it parses in the order of a
+    #: plain dict, so this is only the default where dicts keep their
+    #: insertion order; elsewhere, parsing one part at a time keeps
+    #: the sections in the order they were created.
+    batch_parse = sys.version_info[:2] >= (3, 6) or hasattr(sys, 'pypy_version_info')
 
     def __init__(self, buildout, my_name, my_options):
         self.buildout = buildout
@@ -97,6 +206,21 @@ class MultiStorageRecipe(MetaRecipe):
         # Likewise, but referring to settings that define a <zodb>
         # element as a string. Order matters.
         self._zodb_refs = []
+        # Names of the parts that write files.
+        self._file_part_names = []
+        # Maps (kind, name) to refs for the manifest, in the order
+        # added. The refs are the settings whose values make up the
+        # configuration of the storage or server *name*.
+        self._manifest_configs = OrderedDict()
+        # The compress mode clients use for each storage, in order.
+        self._client_compress_modes = []
+        # The text of parts waiting to be parsed, in order, when
+        # batch_parse is on.
+        self._pending_parts = [] if self.batch_parse else None
+
+        # (storage name, shard group) pairs
+        self._storages = expand_storage_names(my_options.get('storages', ''))
+        self._shard_groups = dict(self._storages)
 
         self.my_options_base_name = self.my_name + '_opts_base'
         buildout[self.my_options_base_name] = {
@@ -112,6 +236,64 @@ class MultiStorageRecipe(MetaRecipe):
         # Adds the ZCML at part:setting to zodb_conf.xml
         self._zodb_refs.append(Ref(part, setting))
 
+    def add_manifest_config(self, name, part, setting, kind='storage'):
+        """
+        Record that the configuration of the storage (or server) *name*
+        includes the value of part:setting.
+        """
+        self._manifest_configs.setdefault((kind, name), []).append(Ref(part, setting))
+
+    #: The ``pool_timeout`` used with ``worker-concurrency`` if
+    #: none is given.
+    planned_pool_timeout = '10m'
+
+    def planned_pool_settings(self):
+        """
+        Return the ``pool_size`` and ``pool_timeout`` settings to use
+        by default for the ``<zodb>`` of each storage, based on the
+        ``worker-concurrency`` option.
+
+        The primary database needs a connection for each concurrent
+        worker. Secondary databases are only opened through a primary
+        connection, which keeps the secondary connection, so they need
+        no more than that. Connections opened beyond that (in a burst
+        of work) are closed after ``pool_timeout``.
+        """
+        concurrency = self.my_options.get('worker-concurrency')
+        if not concurrency:
+            return {}
+        concurrency = _option_count(concurrency, 'worker-concurrency')
+        return {
+            'pool_size': concurrency,
+            'pool_timeout': self.planned_pool_timeout,
+        }
+
+    def optional_zodb_settings(self, section_names):
+        """
+        Find the :attr:`zodb._optional_settings` that are set (with
+        either spelling) in any of the buildout sections named in
+        *section_names*, or in this recipe's options.
+
+        Returns a tuple of the keyword arguments for the ``<zodb>``
+        section, and those for the part it's rendered for. Like
+        ``cache_size``, each storage's value is looked up in its
+        part, where the default is ZODB's own.
+        """
+        sections = [self.my_options]
+        sections.extend(self.buildout.get(section_name) or {}
+                        for section_name in section_names)
+        zodb_kwargs = {}
+        part_kwargs = {}
+        for key, default in zodb._optional_settings:
+            hyphenated_key = key.replace('_', '-')
+            if not any(key in section or hyphenated_key in section
+                       for section in sections):
+                continue
+            zodb_kwargs[key] = Ref(hyphenated_key).hyphenate()
+            part_kwargs[hyphenated_key] = Ref(key)
+            part_kwargs[key] = default
+        return zodb_kwargs, part_kwargs
+
     def ref(self, part, setting=None):
         """
         Return a substitution reference: ${part:setting}.
@@ -159,10 +341,59 @@ class MultiStorageRecipe(MetaRecipe):
 
     def _parse(self, part):
         __traceback_info__ = part
-        return self.buildout.parse(str(part))
+        text = str(part)
+        if self._pending_parts is not None:
+            self._pending_parts.append(text)
+        else:
+            self.buildout.parse(text)
+
+    def parse_pending_parts(self):
+        """
+        Give buildout all the parts created so far when
+        batching. After this, parts are parsed as they are created.
+        """
+        pending = self._pending_parts
+        self._pending_parts = None
+        if pending:
+            __traceback_info__ = pending
+            self.buildout.parse('\n'.join(pending))
+
+    def _parse_file(self, part):
+        # Parse a part using file_recipe, recording it for the manifest.
+        self._file_part_names.append(part.name)
+        self._parse(part)
+
+    def storage_names(self):
+        """
+        Return the names of the storages, with shard ranges expanded.
+        """
+        return [storage for storage, _ in self._storages]
+
+    def storage_opts_names(self, prefix, storage, suffix):
+        """
+        Return the names of the ``_opts`` sections for *storage*,
+        in increasing precedence: for a shard, the one shared by its
+        group (``<prefix><group>_shards<suffix>``), then its own
+        (``<prefix><storage><suffix>``).
+        """
+        names = [prefix + storage.lower() + suffix]
+        group = self._shard_groups.get(storage)
+        if group:
+            names.insert(0, prefix + group.lower() + '_shards' + suffix)
+        return names
+
+    def storage_opts(self, prefix, storage, suffix):
+        """
+        Return the settings in the :meth:`storage_opts_names` sections
+        for *storage* that exist, merged.
+        """
+        result = {}
+        for section_name in self.storage_opts_names(prefix, storage, suffix):
+            result.update(self.buildout.get(section_name) or {})
+        return result
 
     def _normalized_storage_names(self):
-        return [x.lower() for x in self.my_options['storages'].split()]
+        return [x.lower() for x in self.storage_names()]
 
     def buildout_add_mkdirs(self, name=None):
         # For historical reasons (compatibility with existing deployments)
@@ -175,12 +406,13 @@ class MultiStorageRecipe(MetaRecipe):
         self._parse(part)
 
     import_relstorage = '%import relstorage'
+    file_recipe = 'nti.recipes.zodb:file'
 
     def buildout_add_zodb_conf(self):
         zcml_names = self.__refs_to_lines(self._zodb_refs)
         part = Part(
             'zodb_conf',
-            recipe='collective.recipe.template',
+            recipe=self.file_recipe,
             output=deployment.etc / 'zodb_conf.xml',
             input=[
                 'inline:',
@@ -188,41 +420,179 @@ class MultiStorageRecipe(MetaRecipe):
                 self.import_relstorage,
             ] + zcml_names
         )
-        self._parse(part)
-
-    def zlibstorage_import(self):
-        return '%import zc.zlibstorage' if self.needs_zlibstorage() else ''
+        self._parse_file(part)
 
     def buildout_add_zeo_uris(self):
+        uri = "zconfig://${zodb_conf:output}#%s"
         uris = ' '.join(
-            "zconfig://${zodb_conf:output}#%s" % name
+            uri % name
             for name in self._normalized_storage_names()
         )
+        lines = [
+            'inline:',
+            '[ZODB]',
+            'uris = ' + uris
+        ]
+        # Each group of shards also gets a section, in order,
+        # so applications can route by shard.
+        shards = {}
+        groups = []
+        for storage, group in self._storages:
+            if group:
+                if group not in shards:
+                    groups.append(group)
+                    shards[group] = []
+                shards[group].append(uri % storage.lower())
+        for group in groups:
+            lines.extend([
+                '',
+                '[shards:%s]' % group,
+                'uris = ' + ' '.join(shards[group]),
+            ])
         part = Part(
             'zodb_uri_conf',
-            recipe='collective.recipe.template',
+            recipe=self.file_recipe,
             output=deployment.etc / 'zeo_uris.ini',
-            input=[
-                'inline:',
-                '[ZODB]',
-                'uris = ' + uris
+            input=lines,
+        )
+        self._parse_file(part)
+
+    def buildout_add_manifest(self):
+        kwargs = {}
+        names = {}
+        for (kind, name), refs in self._manifest_configs.items():
+            kwargs[kind + '-' + name] = self.__refs_to_lines(refs)
+            names.setdefault(kind + 's', []).append(name)
+        kwargs.update(names)
+        part = Part(
+            'zodb_manifest',
+            recipe='nti.recipes.zodb:manifest',
+            output=deployment.etc / 'zodb_manifest.json',
+            files=self._file_part_names,
+            **kwargs
+        )
+        self._parse(part)
+
+    compress_modes = ('decompress', 'false', 'none', 'compress', 'true')
+
+    def buildout_add_zodbconvert_script(self, storages):
+        """
+        Add a part for the console script that runs ``zodbconvert``
+        for *storages* in parallel. See :mod:`nti.recipes.zodb.zodbconvert`
+        for what each of *storages* contains.
+        """
+        script_name = self.my_options.get('zodbconvert-script') or (self.my_name + '-zodbconvert')
+        part = Part(
+            self._derive_related_part_name('zodbconvert'),
+            recipe='zc.recipe.egg:scripts',
+            eggs='nti.recipes.zodb',
+            scripts=script_name,
+            entry_points=hyphenated(script_name + '=nti.recipes.zodb.zodbconvert:main'),
+            arguments=['['] + [
+                '    %r,' % (storage,) for storage in storages
+            ] + [
+                '], %r' % ('${buildout:bin-directory}/zodbconvert',)
             ],
         )
         self._parse(part)
 
+    def buildout_add_zodbpack(self, storages):
+        """
+        Add a ``zodbpack`` configuration for each of *storages*, and a
+        crontab that runs ``zodbpack`` for each of them.
+
+        Each of *storages* is ``(name, zcml, group, lookup)``: *zcml*
+        is the list of lines configuring the storage to pack, *group*
+        identifies the server that does the work of packing it, and
+        *lookup* finds the options of the storage. The packs of each
+        group are spread evenly across ``pack-window`` so that a
+        server only packs one storage at a time.
+        """
+        options = self.my_options
+        window = options.get('pack-window') or '01:00-05:00'
+        weekdays = options.get('pack-weekdays') or '*'
+        groups = {}
+        for storage in storages:
+            groups.setdefault(storage[2], []).append(storage)
+
+        start_times = {}
+        for group_storages in groups.values():
+            times = pack_start_times(len(group_storages), window)
+            for storage, start_time in zip(group_storages, times):
+                start_times[storage[0]] = start_time
+
+        lines = [
+            'inline:',
+            '# Pack the storages of %s, spread across %s.' % (self.my_name, window),
+        ]
+        for storage, zcml, _, lookup in storages:
+            file_part = Part(
+                storage.lower() + '_zodbpack_conf',
+                recipe=self.file_recipe,
+                output=deployment.etc / 'zodbpack' / (storage.lower() + '.xml'),
+                input=['inline:'] + zcml,
+            )
+            self._parse_file(file_part)
+            hour, minute = start_times[storage]
+            command = ['${buildout:bin-directory}/zodbpack',
+                       '-d', lookup('pack-days') or '0']
+            command.extend((lookup('pack-options') or '').split())
+            command.append(str(Ref(file_part.name, 'output')))
+            lines.append('%d %d * * %s %s %s' % (
+                minute, hour, weekdays, Ref('deployment', 'user'), ' '.join(command)))
+
+        self._parse_file(Part(
+            self._derive_related_part_name('zodbpack_crontab'),
+            recipe=self.file_recipe,
+            output=Ref('deployment', 'crontab-directory') / (self.my_name + '-zodbpack'),
+            input=lines,
+        ))
+
     def needs_zlibstorage(self):
         environment = self.buildout.get('environment', {})
         options = self.my_options
         compress_mode = options.get('compress') or environment.get("compress") or 'decompress'
         compress_mode = compress_mode.lower()
-        assert compress_mode in ('decompress', 'false', 'none', 'compress', 'true')
+        assert compress_mode in self.compress_modes
         return None if compress_mode == 'none' else compress_mode
 
-    def zlibstorage_wrapper(self, zcml, wrapper=zlibstorage):
-        compress_mode = self.needs_zlibstorage()
+    def storage_compress_mode(self, section_names):
+        """
+        Return the ``compress`` mode for a storage, as
+        :meth:`needs_zlibstorage` does, but letting the buildout
+        sections named in *section_names* (in increasing precedence)
+        override it.
+        """
+        compress_mode = self.make_buildout_lookup(section_names)('compress')
+        if compress_mode:
+            compress_mode = compress_mode.lower()
+            assert compress_mode in self.compress_modes
+            compress_mode = None if compress_mode == 'none' else compress_mode
+        else:
+            compress_mode = self.needs_zlibstorage()
+        return compress_mode
+
+    def zlibstorage_import(self, compress_modes=None):
+        """
+        Return the ZConfig import for zc.zlibstorage if it's needed by
+        any of *compress_modes*, by default those that clients use, as
+        recorded by subclasses in ``_client_compress_modes`` (or this
+        recipe's mode, if there are none).
+        """
+        if compress_modes is None:
+            compress_modes = self._client_compress_modes or [self.needs_zlibstorage()]
+        return '%import zc.zlibstorage' if any(compress_modes) else ''
+
+    def zlibstorage_wrapper(self, zcml, wrapper=zlibstorage, compress_mode=''):
+        """
+        Wrap *zcml* for the *compress_mode* (by default, that of this
+        recipe).
+        """
+        if compress_mode == '':
+            compress_mode = self.needs_zlibstorage()
         if compress_mode:
             zcml = wrapper(zcml.zconfig_name, zcml)
             if compress_mode in ('decompress', 'false'):
-                zcml.values['compress'] = False
+                zcml['compress'] = False
 
         return zcml
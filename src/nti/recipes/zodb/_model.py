@@ -10,6 +10,7 @@ from __future__ import print_function
 from contextlib import contextmanager
 from collections import namedtuple
 from copy import copy
+from types import MemberDescriptorType as _MemberDescriptorType
 
 class ValueWriter(object):
 
@@ -34,17 +35,105 @@ class ValueWriter(object):
     def append(self, *substrs):
         self._lines[-1] += ''.join(substrs)
 
+_MISSING = object()
+
+def _renders_constant(value):
+    """
+    Does writing *value* produce the same text for any part?
+    """
+    if isinstance(value, (str, bool, int, type(None))):
+        return True
+    if isinstance(value, (list, tuple)) and not hasattr(value, 'renders_constant'):
+        return all(_renders_constant(v) for v in value)
+    renders_constant = getattr(value, 'renders_constant', None)
+    return renders_constant() if renders_constant is not None else False
+
 class _Contained(object):
+    __slots__ = ()
     __parent__ = None
     __name__ = None
 
+class _ValuesSchema(object):
+    """
+    The class-level information needed to build the values of a
+    :class:`_Values` subclass.
+
+    This is computed once per class, so that creating instances only
+    has to merge in the keyword arguments.
+    """
+
+    __slots__ = (
+        'cls',
+        'defaults',
+        '_key_translations',
+    )
+
+    def __init__(self, cls):
+        self.cls = cls
+        self._key_translations = {}
+        defaults = self.defaults = {}
+        for c in reversed(cls.mro()):
+            for k, v in vars(c).items():
+                if k.startswith('_') or callable(v) \
+                   or isinstance(v, (_MemberDescriptorType, property)):
+                    continue
+                # Backport to Python 2
+                if hasattr(v, '__set_name__'):
+                    v.__set_name__(c, k)
+                # Give __get__ a chance.
+                defaults[k] = getattr(cls, k)
+
+    def translate_key(self, k, v):
+        """
+        Return the key that *k* should be stored under,
+        transforming kwargs that had _ back into - and
+        applying :class:`renamed`.
+        """
+        try:
+            cls_hyphenated, new_name = self._key_translations[k]
+        except KeyError:
+            cls_value = getattr(self.cls, k, None)
+            cls_hyphenated = bool(getattr(cls_value, 'hyphenated', None))
+            new_name = getattr(cls_value, 'new_name', None)
+            self._key_translations[k] = cls_hyphenated, new_name
+
+        if cls_hyphenated or getattr(v, 'hyphenated', None):
+            return k.replace('_', '-')
+        if new_name:
+            return new_name
+        return k
+
 class _Values(_Contained):
     "A dict-like mapping if string keys to string values."
 
+    __slots__ = (
+        '__parent__',
+        '__name__',
+        'values',
+        # Only used by _NamedValues, but it has to be declared
+        # here so that ZConfigSection can extend both it and ZConfigSnippet
+        # without a layout conflict.
+        'name',
+        # Things computed while writing that don't change unless
+        # the values do. Shared with shallow copies, which also share
+        # the values.
+        '_render_cache',
+    )
+
+    def __new__(cls, *_args, **_kwargs):
+        inst = super(_Values, cls).__new__(cls)
+        inst.__parent__ = inst.__name__ = None
+        inst._render_cache = {}
+        return inst
+
     def __init__(self, values):
         self.values = self._translate(dict(values))
-        self.keys = self.values.keys
-        self.items = self.values.items
+
+    def keys(self):
+        return self.values.keys()
+
+    def items(self):
+        return self.values.items()
 
     def _owned(self, value):
         if isinstance(value, _Contained):
@@ -58,47 +147,34 @@ class _Values(_Contained):
             value.__parent__ = self
         return value
 
+    @classmethod
+    def _schema(cls):
+        try:
+            return cls.__dict__['_values_schema']
+        except KeyError:
+            schema = _ValuesSchema(cls)
+            setattr(cls, '_values_schema', schema)
+            return schema
+
     def _translate(self, kwargs):
-        cls = type(self)
-        values = {}
-        for c in reversed(cls.mro()):
-            for k, v in vars(c).items():
-                if k.startswith('_') or callable(v):
-                    continue
-                # Backport to Python 2
-                if hasattr(v, '__set_name__'):
-                    v.__set_name__(c, k)
-                # Give __get__ a chance, but only if
-                # it's not hidden by a instance attribute.
-                # (This is a bit weird, but it lets us use 'name'
-                # both as a attribute and in our values)
-                if k not in vars(self) or hasattr(v, '__set__'):
-                    v = getattr(self, k)
-                values[k] = v
+        schema = self._schema()
+        values = dict(schema.defaults)
         values.update(kwargs)
 
-        # Transform kwargs that had _ back into -
-        keys = list(values)
-        for k in keys:
-            v = values[k]
-            cls_value = getattr(cls, k, None)
-            if getattr(cls_value, 'hyphenated', None) \
-               or getattr(values[k], 'hyphenated', None):
-                values.pop(k)
-                k = k.replace('_', '-')
-            elif getattr(cls_value, 'new_name', None):
-                values.pop(k)
-                k = cls_value.new_name
+        translated = {}
+        for k, v in values.items():
+            k = schema.translate_key(k, v)
             v = self._owned(v)
             if hasattr(v, '__name__'):
                 v.__name__ = k
-            values[k] = v
-        return values
+            translated[k] = v
+        return translated
 
     def with_settings(self, **kwargs):
         new_inst = copy(self)
         new_inst.values = copy(self.values)
         new_inst.values.update(kwargs)
+        new_inst._render_cache = {}
         return new_inst
 
     def ref(self):
@@ -107,8 +183,39 @@ class _Values(_Contained):
     def __getitem__(self, key):
         return self.values[key]
 
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        self._invalidate()
+
     def __delitem__(self, key):
         del self.values[key]
+        self._invalidate()
+
+    def _invalidate(self):
+        # Whatever contains us may have cached text that includes ours.
+        obj = self
+        while obj is not None:
+            cache = getattr(obj, '_render_cache', None)
+            if cache is not None:
+                cache.clear()
+            obj = getattr(obj, '__parent__', None)
+
+    def renders_constant(self):
+        """
+        Is the text written for this object the same no matter
+        what part it is written for?
+
+        If so, it is only rendered once and then reused.
+        """
+        cache = self._render_cache
+        try:
+            return cache['constant']
+        except KeyError:
+            result = cache['constant'] = self._compute_renders_constant()
+            return result
+
+    def _compute_renders_constant(self):
+        return all(_renders_constant(v) for v in self.values.values())
 
     def format_value(self, value):
         if hasattr(value, 'format_for_part'):
@@ -155,24 +262,50 @@ class _Values(_Contained):
     _write_trailer = _write_header
 
     def _values_to_write(self):
-        return sorted(self.values.items())
+        cache = self._render_cache
+        try:
+            return cache['items']
+        except KeyError:
+            result = cache['items'] = sorted(self.values.items())
+            return result
 
     def _write_values(self, io, part):
         for k, v in self._values_to_write():
             self._write_one(io, k, v, part)
 
     def write_to(self, io, part=None):
+        if self.renders_constant():
+            for line in self._rendered_lines():
+                io.begin_line(line)
+            return
+
         part = part if part is not None else self
         self._write_header(io, part)
         self._write_values(io, part)
         self._write_trailer(io, part)
 
+    def _rendered_lines(self):
+        # All the indentation we write is relative to what we're given,
+        # so we can render at no indentation and let the caller
+        # add theirs.
+        cache = self._render_cache
+        try:
+            return cache['lines']
+        except KeyError:
+            io = ValueWriter()
+            self._write_header(io, self)
+            self._write_values(io, self)
+            self._write_trailer(io, self)
+            result = cache['lines'] = tuple(io._lines)
+            return result
+
     def __str__(self):
         io = ValueWriter()
         self.write_to(io)
         return io.getvalue()
 
 class _NamedValues(_Values):
+    __slots__ = ()
 
     class uses_name(object):
         def __init__(self, template):
@@ -182,6 +315,9 @@ class _NamedValues(_Values):
             template = part.format_value(self.template)
             return template % (part.name,)
 
+        def renders_constant(self):
+            return False
+
     def __init__(self, name, values):
         self.name = self.__name__ = name
         _Values.__init__(self, values)
@@ -199,41 +335,87 @@ class Part(_NamedValues):
         Remember that in buildout, *later* elements in the
         list take priority over earlier ones, not vice versa.
         (The opposite of Python's class MRO.)
+
+    Values found in *extends* are remembered the first time they are
+    looked up, so the parts (or buildout sections) in *extends*
+    should not be changed after this part has used them.
     """
 
+    __slots__ = (
+        'extends',
+        '_defaults',
+        # key -> value found in extends (reparented to this object),
+        # or _MISSING.
+        '_resolved',
+        # What was assigned to buildout_lookup, if anything.
+        '_buildout_lookup',
+    )
+
     def __init__(self, _name, extends=(), **kwargs):
         super(Part, self).__init__(_name, kwargs)
+        self._buildout_lookup = None
         self.extends = tuple(e for e in extends if e is not None)
         self._defaults = {}
+        self._resolved = {}
 
-    def buildout_lookup(self, key, default=None):
+    def with_settings(self, **kwargs):
+        new_inst = super(Part, self).with_settings(**kwargs)
+        # The copy has different values (and is a different parent),
+        # so what we found before doesn't apply.
+        new_inst._resolved = {}
+        return new_inst
+
+    @property
+    def buildout_lookup(self):
         """
+        A function ``(key, default=None)``.
+
         By default, this is the same as :meth:`get`, but
         recipes running inside buildout that have a true picture
         of the precedence may replace this method to provide
         a lookup of the actual option value.
         """
-        return self.get(key, default) # pragma: no cover
+        return self._buildout_lookup or self.get
+
+    @buildout_lookup.setter
+    def buildout_lookup(self, lookup):
+        self._buildout_lookup = lookup
+
+    def __delitem__(self, key):
+        super(Part, self).__delitem__(key)
+        self._resolved.pop(key, None)
 
     def __getitem__(self, key):
         try:
-            return super(Part, self).__getitem__(key)
+            return self.values[key]
         except KeyError:
-            for extension in reversed(self.extends):
-                try:
-                    v = extension[key]
-                except (TypeError, KeyError):
-                    pass
-                else:
-                    if hasattr(v, '__parent__'):
-                        v = copy(v)
-                        v.__parent__ = self
-                    return v
-            # On Python 2, if we raised an exception in the
-            # loop, it will overwrite the KeyError we
-            # originally caught, and we could wind up with a TypeError,
-            # which is not what we want.
+            pass
+
+        try:
+            v = self._resolved[key]
+        except KeyError:
+            v = self._resolved[key] = self._resolve_extended(key)
+
+        if v is _MISSING:
             raise KeyError(key)
+        return v
+
+    def _resolve_extended(self, key):
+        # Parts in our extends remember what they resolved too,
+        # so a shared base is only searched once for each key.
+        for extension in reversed(self.extends):
+            try:
+                v = extension[key]
+            except (TypeError, KeyError):
+                pass
+            else:
+                # Reparent a copy. Because the result is
+                # remembered, this only happens once per key.
+                if hasattr(v, '__parent__'):
+                    v = copy(v)
+                    v.__parent__ = self
+                return v
+        return _MISSING
 
     def get(self, key, default=None):
         try:
@@ -252,7 +434,16 @@ class Part(_NamedValues):
             self._write_one(io, 'recipe', self.values['recipe'], part)
 
     def add_default(self, key, value):
-        self._defaults[key] = value
+        """
+        Write *key* with *value*, unless a default was already
+        added for it.
+        """
+        self._defaults.setdefault(key, value)
+
+    def renders_constant(self):
+        # Our header asserts it is written for ourself, and
+        # writing our values may add defaults.
+        return False
 
     def _values_to_write(self):
         for k, v in super(Part, self)._values_to_write():
@@ -268,6 +459,7 @@ class Part(_NamedValues):
 # prefix='')``.  They handle imports but not defines.
 
 class ZConfigSnippet(_Values):
+    __slots__ = ('trailer',)
     _skip_empty_values = True
     _key_value_sep = ' '
     _body_indention = '  '
@@ -280,6 +472,12 @@ class ZConfigSnippet(_Values):
             self.trailer.__parent__ = self
         _Values.__init__(self, kwargs)
 
+    def _compute_renders_constant(self):
+        return (
+            super(ZConfigSnippet, self)._compute_renders_constant()
+            and _renders_constant(self.trailer)
+        )
+
     def _write_trailer(self, io, part):
         if self.trailer:
             with io.indented(self._body_indention):
@@ -291,6 +489,10 @@ class ZConfigSnippet(_Values):
 
 
 class ZConfigSection(_NamedValues, ZConfigSnippet):
+    __slots__ = (
+        'zconfig_name',
+        'sections',
+    )
 
     def __init__(self, _section_key, _section_name, *sections, **kwargs):
         ZConfigSnippet.__init__(self, **kwargs)
@@ -302,6 +504,14 @@ class ZConfigSection(_NamedValues, ZConfigSnippet):
         for s in self.sections:
             s.__parent__ = self
 
+    def _compute_renders_constant(self):
+        return (
+            super(ZConfigSection, self)._compute_renders_constant()
+            and _renders_constant(self.name)
+            and _renders_constant(self.zconfig_name)
+            and all(s.renders_constant() for s in self.sections)
+        )
+
     def _write_values(self, io, part):
         with io.indented(self._body_indention):
             super(ZConfigSection, self)._write_values(io, part)
@@ -337,6 +547,9 @@ class Ref(_Contained, namedtuple('_SubstititionRef', ('part', 'setting'))):
     def format_for_part(self, _):
         return self.__str__()
 
+    def renders_constant(self):
+        return True
+
     def __copy__(self):
         return self
 
@@ -374,10 +587,16 @@ class _HyphenatedRef(Ref):
     hyphenated = True
 
 class _Const(_Contained):
+    __slots__ = (
+        'const',
+        '__parent__',
+        '__name__',
+    )
     hyphenated = False
 
     def __init__(self, const):
         self.const = const
+        self.__parent__ = self.__name__ = None
 
     def __bool__(self):
         return self.const is not None
@@ -390,13 +609,14 @@ class _Const(_Contained):
     def format_for_part(self, part):
         return part.format_value(self.const)
 
+    def renders_constant(self):
+        return _renders_constant(self.const)
+
     def __str__(self):
         return str(self.const)
 
     def hyphenate(self):
-        inst = type(self)(self.const)
-        inst.hyphenated = True
-        return inst
+        return hyphenated(self.const)
 
 class hyphenated(_Const):
     hyphenated = True
@@ -420,6 +640,14 @@ class Default(_Const):
     def __get__(self, inst, cls):
         return self
 
+    def hyphenate(self):
+        inst = type(self)(self.const)
+        inst.hyphenated = True
+        return inst
+
+    def renders_constant(self):
+        return False
+
     def format_for_part(self, part):
         part.add_default(self._bound_name, self.const)
         return RelativeRef(self._bound_name).format_for_part(part)
@@ -454,8 +682,15 @@ class renamed(object):
         self.new_name = new_name
 
 class _CompoundValue(_Contained):
+    __slots__ = (
+        '_values',
+        '__parent__',
+        '__name__',
+    )
+
     def __init__(self, *values):
         self._values = values
+        self.__parent__ = self.__name__ = None
 
     def __add__(self, other):
         v = self._values + (other,)
@@ -483,6 +718,9 @@ class _CompoundValue(_Contained):
             strs.append(str(part.format_value(v)))
         return ''.join(strs)
 
+    def renders_constant(self):
+        return all(_renders_constant(v) for v in self._values)
+
     def __str__(self):
         part = Part('<invalid part>')
         return self.format_for_part(part)
@@ -494,12 +732,21 @@ class ChoiceRef(_Contained):
     References a different section:setting based on looking up the
     part's name in the section map.
     """
-    __slots__ = ('section_map', 'setting')
+    __slots__ = (
+        'section_map',
+        'setting',
+        '__parent__',
+        '__name__',
+    )
 
     def __init__(self, section_map, setting):
         self.section_map = section_map
         self.setting = setting
+        self.__parent__ = self.__name__ = None
 
     def format_for_part(self, part):
         section = self.section_map[part.name]
         return str(Ref(section, self.setting))
+
+    def renders_constant(self):
+        return False
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Recipes to write the generated configuration files.
+
+Files are only written when their contents change, so that anything
+watching their modification times (like process supervisors) only
+notices real changes. A manifest records a hash of the configuration
+for each storage (and server) and which of them changed in the most
+recent run.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import io
+import json
+import os
+import stat
+import tempfile
+
+logger = __import__('logging').getLogger(__name__)
+
+def content_hash(content):
+    """
+    Return the hex digest identifying the text *content*.
+    """
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+def file_hash(path):
+    """
+    Return the :func:`content_hash` of the file at *path*,
+    or None if it cannot be read.
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return content_hash(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+
+def _file_mode(path):
+    # The mode to write *path* with: that of the existing file, or
+    # else what the umask allows, as for any other new file.
+    # (mkstemp creates files only the owner can read.)
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def write_if_changed(path, content):
+    """
+    Write *content* to *path* unless it already contains
+    exactly that.
+
+    The file is replaced atomically, keeping its mode; a new file
+    gets the mode the umask allows. Returns whether the file
+    was written.
+    """
+    if file_hash(path) == content_hash(content):
+        return False
+    if isinstance(content, bytes):
+        content = content.decode('utf-8') # Python 2
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    mode = _file_mode(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or None,
+                                    prefix='.' + os.path.basename(path))
+    try:
+        os.chmod(tmp_path, mode)
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+def rendered_content(options):
+    """
+    Return the text to write for a section using the :class:`File`
+    recipe. The ``input`` option must begin with ``inline:``, as for
+    collective.recipe.template.
+    """
+    source = options['input']
+    assert source.startswith('inline:'), source
+    return source[len('inline:'):].lstrip()
+
+
+class File(object):
+    """
+    Writes ``input`` to ``output``, if it changed.
+
+    The file is not removed when the part is uninstalled; that would
+    defeat leaving unchanged files alone when buildout reinstalls the
+    part. Instead, :class:`Manifest` removes files that are no longer
+    generated.
+    """
+
+    def __init__(self, buildout, name, options):
+        self.options = options
+        self.content = rendered_content(options)
+
+    def install(self):
+        if write_if_changed(self.options['output'], self.content):
+            logger.info("Wrote %s", self.options['output'])
+        return ()
+
+    update = install
+
+
+class Manifest(object):
+    """
+    Writes a JSON manifest of hashes to ``output``.
+
+    The ``files`` option lists the sections (using the :class:`File`
+    recipe) whose output is recorded. The ``storages`` and ``servers``
+    options list names; for each name, the option ``storage-<name>``
+    or ``server-<name>`` is the configuration to hash.
+
+    Comparing against the manifest already on disk, the names that
+    were added, changed or removed are listed in the ``changed``
+    mapping. Files in that manifest that are no longer generated are
+    removed. Their directories are left alone: some of them, like the
+    deployment's ``crontab-directory``, aren't ours to remove.
+    """
+
+    kinds = ('storage', 'server')
+
+    def __init__(self, buildout, name, options):
+        self.options = options
+        files = {}
+        for section in options.get('files', '').split():
+            file_options = buildout[section]
+            files[file_options['output']] = content_hash(rendered_content(file_options))
+        self.hashes = {'files': files}
+
+        for kind in self.kinds:
+            self.hashes[kind + 's'] = {
+                name: content_hash(options[kind + '-' + name])
+                for name in options.get(kind + 's', '').split()
+            }
+
+    def _previous(self):
+        try:
+            with io.open(self.options['output'], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def install(self):
+        previous = self._previous()
+        manifest = dict(self.hashes)
+        manifest['changed'] = changed = {}
+        for key, hashes in self.hashes.items():
+            old_hashes = previous.get(key, {})
+            changed[key] = sorted(
+                name
+                for name in set(hashes) | set(old_hashes)
+                if hashes.get(name) != old_hashes.get(name)
+            )
+            if changed[key]:
+                logger.info("Changed %s: %s", key, ' '.join(changed[key]))
+
+        for path in previous.get('files', {}):
+            if path not in self.hashes['files']:
+                self._remove(path)
+
+        write_if_changed(
+            self.options['output'],
+            json.dumps(manifest, indent=2, sort_keys=True) + '\n'
+        )
+        return ()
+
+    update = install
+
+    def _remove(self, path):
+        logger.info("Removing %s", path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -10,9 +10,13 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import hashlib
+import importlib
 import io
+import math
 
 import ZConfig.schemaless
+from zc.buildout import UserError
 
 from ._model import Part
 from ._model import ZConfigSection
@@ -26,13 +30,12 @@ from . import MultiStorageRecipe
 from . import filestorage
 from . import zodb
 from . import ZodbClientPart
+from . import _option_true
+from . import deployment
 
 logger = __import__('logging').getLogger(__name__)
 NativeStringIO = io.BytesIO if bytes is str else io.StringIO
 
-def _option_true(value):
-    return value and value.lower() in ('1', 'yes', 'on', 'true')
-
 class relstorage(ZConfigSection):
     blob_cache_size = LocalSubstVar('blob-cache-size').hyphenate()
     blob_dir = LocalSubstVar("blob_dir").hyphenate()
@@ -45,7 +48,7 @@ class relstorage(ZConfigSection):
     pack_gc = LocalSubstVar('pack-gc').hyphenate()
     shared_blob_dir = LocalSubstVar('shared-blob-dir').hyphenate()
 
-    def __init__(self, memcache_config):
+    def __init__(self, memcache_config, **kwargs):
         ZConfigSection.__init__(
             self, 'relstorage', LocalSubstVar('name'),
             # One section, <$adapter>
@@ -54,6 +57,7 @@ class relstorage(ZConfigSection):
                 APPEND=LocalSubstVar('sql_adapter_args')
             ),
             APPEND=memcache_config,
+            **kwargs
         )
 
 class BaseStoragePart(ZodbClientPart):
@@ -94,6 +98,200 @@ class BaseStoragePart(ZodbClientPart):
     sql_adapter_extra_args = None
 
 
+def allocate_cache_budget(budget_mb, weights, explicit_mb=None):
+    """
+    Divide *budget_mb* into ``cache-local-mb`` values.
+
+    *weights* maps storage names to their relative weights.
+    *explicit_mb* maps the names of storages that have an explicit
+    size to that size (in MB); those are used as given, and subtracted
+    from the budget before dividing what's left among the other
+    storages in proportion to their weight.
+
+    Returns a mapping from storage name to size in MB.
+    """
+    explicit_mb = explicit_mb or {}
+    remaining = budget_mb - sum(explicit_mb.values())
+    weighted = {k: w for k, w in weights.items() if k not in explicit_mb}
+    total_weight = sum(weighted.values())
+    if weighted and remaining <= 0:
+        logger.warning(
+            "The cache memory budget of %d MB is used up by explicit sizes; "
+            "disabling the local cache for %s",
+            budget_mb, ' '.join(sorted(weighted)))
+    result = dict(explicit_mb)
+    for k, weight in weighted.items():
+        if remaining <= 0 or not total_weight:
+            result[k] = 0
+        else:
+            result[k] = int(remaining * weight / total_weight)
+    return result
+
+def _parse_sql_hosts(value):
+    # ``host`` or ``host=weight``, whitespace delimited.
+    hosts = []
+    for entry in value.split():
+        host, _, weight = entry.partition('=')
+        if not host:
+            raise UserError("Invalid sql_hosts entry %r; it has no host" % (entry,))
+        # The host ends up in the adapter's host argument or the
+        # DSN's host key, neither of which takes a port. (IPv6
+        # addresses have more than one colon.)
+        if host.count(':') == 1 or host.startswith('['):
+            raise UserError(
+                "Invalid sql_hosts entry %r; give only the host, and set the port "
+                "in sql_adapter_extra_args" % (entry,))
+        hosts.append((host, _weight(weight or '1', 'sql_hosts weight for ' + host)))
+    return hosts
+
+def _hash_score(storage, host, weight):
+    # Rendezvous (highest random weight) hashing: a storage only moves
+    # when the host it was on goes away, or a host is added and takes
+    # its fair share.
+    digest = hashlib.sha1(('%s %s' % (storage, host)).encode('utf-8')).hexdigest()
+    fraction = (int(digest[:13], 16) + 1) / float(2 ** 52 + 2)
+    return -weight / math.log(fraction)
+
+def place_storages(storages, hosts, placement='round-robin'):
+    """
+    Assign each of *storages* to one of the SQL *hosts*.
+
+    *hosts* is a sequence of ``(host, weight)`` pairs. *placement* is
+    one of:
+
+    ``round-robin``
+        Storages are assigned to the hosts in turn, ignoring weights.
+    ``hash``
+        Each storage goes to the host chosen by consistent hashing of
+        its name, so adding or removing a host only moves the storages
+        that must move. Hosts with larger weights get more storages.
+    ``weighted``
+        Storages are assigned in order to the host with the fewest
+        storages in proportion to its weight.
+
+    Returns a mapping from storage name to host.
+    """
+    if not hosts:
+        return {}
+    result = {}
+    if placement == 'round-robin':
+        for i, storage in enumerate(storages):
+            result[storage] = hosts[i % len(hosts)][0]
+    elif placement == 'hash':
+        for storage in storages:
+            result[storage] = max(
+                hosts,
+                key=lambda hw, storage=storage: _hash_score(storage, *hw))[0]
+    elif placement == 'weighted':
+        counts = [0] * len(hosts)
+        for storage in storages:
+            i = min(range(len(hosts)), key=lambda i: (counts[i] + 1) / hosts[i][1])
+            counts[i] += 1
+            result[storage] = hosts[i][0]
+    else:
+        raise UserError("Unknown sql_host_placement %r; choose from: round-robin, hash, weighted"
+                        % (placement,))
+    return result
+
+_SIZE_SUFFIXES = (
+    ('kb', 1.0 / 1024),
+    ('mb', 1),
+    ('gb', 1024),
+    ('tb', 1024 * 1024),
+)
+
+def _size_in_mb(value, option):
+    # A number of MB, optionally with a kb, mb, gb or tb suffix.
+    number = value.strip().lower()
+    multiplier = 1
+    for suffix, suffix_multiplier in _SIZE_SUFFIXES:
+        if number.endswith(suffix):
+            multiplier = suffix_multiplier
+            number = number[:-2]
+            break
+    try:
+        number = float(number)
+    except ValueError:
+        number = -1
+    if not 0 <= number < float('inf'):
+        raise UserError("Invalid %s %r; give a size in MB, or with a kb, mb, gb or tb suffix"
+                        % (option, value))
+    return int(number * multiplier)
+
+def _weight(value, option):
+    try:
+        weight = float(value)
+    except ValueError:
+        weight = -1
+    if not 0 < weight < float('inf'):
+        raise UserError("Invalid %s %r; it must be a number greater than 0" % (option, value))
+    return weight
+
+#: The RelStorage drivers for each adapter, fastest first, and the
+#: modules each needs.
+SQL_DRIVERS = {
+    'mysql': (
+        ('MySQLdb', ('MySQLdb',)),
+        ('gevent MySQLdb', ('MySQLdb', 'gevent')),
+        ('C MySQL Connector/Python', ('mysql.connector', '_mysql_connector')),
+        ('PyMySQL', ('pymysql',)),
+        ('Py MySQL Connector/Python', ('mysql.connector',)),
+    ),
+    'postgresql': (
+        ('psycopg2', ('psycopg2',)),
+        ('gevent psycopg2', ('psycopg2', 'gevent')),
+        ('psycopg2cffi', ('psycopg2cffi',)),
+        ('pg8000', ('pg8000',)),
+    ),
+    'sqlite3': (
+        ('sqlite3', ('sqlite3',)),
+        ('gevent sqlite3', ('sqlite3', 'gevent')),
+    ),
+}
+
+def _importable(module_name):
+    try:
+        importlib.import_module(module_name)
+    except ImportError:
+        return False
+    return True
+
+def select_sql_driver(adapter, requested, importable=_importable):
+    """
+    Return the name of the RelStorage driver to use for *adapter*.
+
+    If *requested* is ``auto``, this is the fastest driver whose
+    modules are *importable*; ``gevent auto`` chooses among the
+    gevent-aware drivers. Otherwise, *requested* names the driver,
+    which must be available. Raises :class:`zc.buildout.UserError` if
+    there is no such driver.
+    """
+    drivers = SQL_DRIVERS.get(adapter, ())
+    if requested in ('auto', 'gevent auto'):
+        want_gevent = requested != 'auto'
+        candidates = [
+            d for d in drivers
+            if d[0].startswith('gevent ') == want_gevent
+        ]
+    else:
+        candidates = [d for d in drivers if d[0] == requested]
+        if not candidates:
+            raise UserError("Unknown %s driver %r; choose from: auto, gevent auto, %s" % (
+                adapter, requested, ', '.join(d[0] for d in drivers)))
+
+    for driver, modules in candidates:
+        if all(importable(m) for m in modules):
+            return driver
+    raise UserError("The %s driver %r is not available; install one of: %s" % (
+        adapter, requested, ', '.join(
+            ' and '.join(modules) for _, modules in candidates)))
+
+def _dsn_quote(value):
+    """
+    Quote *value* for use in a libpq connection string.
+    """
+    return "'%s'" % (str(value).replace('\\', '\\\\').replace("'", "\\'"),)
+
 def _ZConfig_write_to(config, writer, part):
     writer.begin_line("# This comment preserves whitespace")
     indent = writer.current_indent * 2 + '  '
@@ -106,6 +304,7 @@ class Databases(MultiStorageRecipe):
 
     def __init__(self, buildout, name, options):
         MultiStorageRecipe.__init__(self, buildout, name, options)
+        self._sql_drivers = {}
         # Get the 'environment' block from buildout if it exists. This is for
         # combatibility with existing buildouts.
         environment = buildout.get('environment', {})
@@ -151,9 +350,28 @@ class Databases(MultiStorageRecipe):
             extra_base_kwargs = {}
             remote_cache_config = ZConfigSnippet()
 
-        relstorage_zcml = self.zlibstorage_wrapper(relstorage(remote_cache_config))
-        filestorage_zcml = self.zlibstorage_wrapper(filestorage(self.ref('filestorage_name')))
         blob_cache_size = options.get('blob-cache-size', '')
+
+        def relstorage_zcml(compress_mode='', **kwargs):
+            zcml = relstorage(remote_cache_config, **kwargs)
+            # TODO: Let this be configured for each storage.
+            if not blob_cache_size:
+                del zcml['blob-cache-size']
+            return self.zlibstorage_wrapper(zcml, compress_mode=compress_mode)
+
+        def filestorage_zcml(compress_mode=''):
+            return self.zlibstorage_wrapper(filestorage(self.ref('filestorage_name')),
+                                            compress_mode=compress_mode)
+
+        recipe_compress_mode = self.needs_zlibstorage()
+        pool_plan = self.planned_pool_settings()
+        storages = self.storage_names()
+        zodb_kwargs, zodb_part_kwargs = self.optional_zodb_settings(
+            [name + '_opts'] + [
+                opts_name
+                for storage in storages
+                for opts_name in self.storage_opts_names(name + '_', storage, '_storage_opts')
+            ])
         # Order matters
         base_storage_name = name + '_base_storage'
 
@@ -163,22 +381,21 @@ class Databases(MultiStorageRecipe):
             sql_passwd=sql_passwd,
             sql_host=sql_host,
             sql_adapter=sql_adapter,
-            storage_zcml=relstorage_zcml,
-            client_zcml=zodb(self.ref('name'), self.ref('storage_zcml')),
-            filestorage_zcml=filestorage_zcml,
+            storage_zcml=relstorage_zcml(),
+            client_zcml=zodb(self.ref('name'), self.ref('storage_zcml'), **zodb_kwargs),
+            filestorage_zcml=filestorage_zcml(),
             relstorage_name_prefix=relstorage_name_prefix,
             cache_local_dir=cache_local_dir,
             blob_cache_size=blob_cache_size,
-            **extra_base_kwargs
+            **dict(zodb_part_kwargs, **extra_base_kwargs)
         )
+        if pool_plan:
+            # pool_timeout has no default, so it's found by
+            # the lookup above.
+            base_storage_part.add_default('pool_size', pool_plan['pool_size'])
 
-        # TODO: Let this be configured for each storage.
         if not blob_cache_size:
             del base_storage_part['blob-cache-size']
-            zcml = base_storage_part['storage_zcml']
-            if hasattr(zcml, 'storage'):
-                zcml = zcml.storage # unwrap zlibstorage
-            del zcml['blob-cache-size']
 
         # TODO: This is for pool_timeout; it supports
         # configuring in _opts_base and _opts, but not per-storage.
@@ -186,16 +403,24 @@ class Databases(MultiStorageRecipe):
         # there must be a a value in opts_base or _opts first.
         # We only document the shared values though.
         base_storage_part.buildout_lookup = self.make_buildout_lookup((
+            pool_plan,
             name + '_opts_base',
             name + '_opts',
             extra_base_kwargs,
         ))
 
         self._parse(base_storage_part)
-        storages = options['storages'].split()
+        cache_local_mbs = self._allocate_cache_budget(name, storages)
+        write_zodbconvert = _option_true(options.get('write-zodbconvert', 'false'))
+        zodbconvert_storages = []
+        write_zodbpack = _option_true(options.get('write-zodbpack', 'false'))
+        zodbpack_storages = []
+        sql_hosts = self._place_storages(name, storages)
 
         for storage in storages:
             part_name = name + '_' + storage.lower() + '_storage'
+            # A shard's group _opts come before its own.
+            storage_opts_names = self.storage_opts_names(name + '_', storage, '_storage_opts')
             # Note that while it would be nice to automatically extend
             # from this section, that leads to a recursive invocation
             # of this recipe, which obviously fails (with weird errors
@@ -205,12 +430,38 @@ class Databases(MultiStorageRecipe):
                 base_storage_part,
                 buildout.get(name + '_opts_base'),
                 buildout.get(name + '_opts'),
-                buildout.get(part_name + '_opts')
+            ] + [
+                buildout.get(opts_name)
+                for opts_name in storage_opts_names
             ]
+            part_kwargs = {}
+            if storage in cache_local_mbs:
+                part_kwargs['cache_local_mb'] = cache_local_mbs[storage]
+            if storage in sql_hosts:
+                part_kwargs['sql_host'] = sql_hosts[storage]
+            storage_lookup = self.make_buildout_lookup([
+                name + '_opts_base',
+                name + '_opts',
+            ] + storage_opts_names)
+            relstorage_kwargs = self.__create_replica_parts(storage, part_name, storage_lookup)
+            relstorage_kwargs.update(self._pack_settings(storage_lookup))
+            compress_mode = self.storage_compress_mode(
+                [name + '_opts'] + storage_opts_names)
+            self._client_compress_modes.append(compress_mode)
+            # Storages that compress differently than the recipe
+            # get their own ZCML.
+            compress_kwargs = {}
+            if compress_mode != recipe_compress_mode:
+                compress_kwargs['storage_zcml'] = relstorage_zcml(compress_mode)
+                compress_kwargs['filestorage_zcml'] = filestorage_zcml(compress_mode)
+                part_kwargs.update(compress_kwargs)
+            if relstorage_kwargs:
+                part_kwargs['storage_zcml'] = relstorage_zcml(compress_mode, **relstorage_kwargs)
             part = Part(
                 part_name,
                 extends=other_bases_list,
                 name=storage,
+                **part_kwargs
             )
 
             part = part.with_settings(**self.__adapter_settings(part))
@@ -220,13 +471,146 @@ class Databases(MultiStorageRecipe):
             self.create_directory(part_name, 'blob_dir')
             self.create_directory(part_name, 'cache-local-dir')
             self.add_database(part_name, 'client_zcml')
-
-            if _option_true(options.get('write-zodbconvert', 'false')):
-                self.__create_zodbconvert_parts(part)
+            self.add_manifest_config(storage, part_name, 'client_zcml')
+
+            if write_zodbconvert:
+                zodbconvert_storages.append(
+                    self.__create_zodbconvert_parts(part, compress_mode, compress_kwargs))
+
+            if write_zodbpack:
+                # Packing is done by the SQL server the storage is on.
+                zodbpack_storages.append((
+                    storage,
+                    [
+                        self.zlibstorage_import([compress_mode]),
+                        '%import relstorage',
+                        str(SubstVar(part_name, 'storage_zcml')),
+                    ],
+                    part.format_value(part.get('sql_host')),
+                    storage_lookup,
+                ))
+
+        if write_zodbconvert:
+            self.buildout_add_zodbconvert_script(zodbconvert_storages)
+        if write_zodbpack:
+            self.buildout_add_zodbpack(zodbpack_storages)
 
         self.buildout_add_mkdirs(name='blob_dirs')
         self.buildout_add_zodb_conf()
         self.buildout_add_zeo_uris()
+        self.buildout_add_manifest()
+        self.parse_pending_parts()
+
+    def _allocate_cache_budget(self, name, storages):
+        """
+        If there's a ``cache-memory-budget``, return a mapping from
+        storage name to ``cache-local-mb`` for the storages that don't
+        set that explicitly in their ``_opts`` part, as allocated by
+        :func:`allocate_cache_budget` using the ``cache-weight`` in
+        each storage's ``_opts`` part.
+        """
+        budget = self.my_options.get('cache-memory-budget')
+        if not budget:
+            return {}
+        weights = {}
+        explicit = {}
+        for storage in storages:
+            storage_opts = self.storage_opts(name + '_', storage, '_storage_opts')
+            value = storage_opts.get('cache_local_mb') or storage_opts.get('cache-local-mb')
+            if value:
+                explicit[storage] = _size_in_mb(value, 'cache_local_mb for ' + storage)
+            else:
+                weights[storage] = _weight(storage_opts.get('cache-weight') or '1',
+                                           'cache-weight for ' + storage)
+
+        allocation = allocate_cache_budget(_size_in_mb(budget, 'cache-memory-budget'),
+                                           weights, explicit)
+        logger.info(
+            "Allocated cache-local-mb from a budget of %s: %s",
+            budget,
+            ', '.join('%s=%s%s' % (storage, allocation[storage],
+                                   ' (explicit)' if storage in explicit else '')
+                      for storage in storages))
+        return {k: v for k, v in allocation.items() if k not in explicit}
+
+    def _place_storages(self, name, storages):
+        """
+        If there are ``sql_hosts``, return a mapping from storage name
+        to ``sql_host`` for the storages that don't set that
+        explicitly in their ``_opts`` part, as assigned by
+        :func:`place_storages` using ``sql_host_placement``.
+        """
+        hosts = _parse_sql_hosts(self.my_options.get('sql_hosts', ''))
+        if not hosts:
+            return {}
+        placed = [
+            storage for storage in storages
+            if not self.storage_opts(name + '_', storage, '_storage_opts').get('sql_host')
+        ]
+        placement = self.my_options.get('sql_host_placement') or 'round-robin'
+        result = place_storages(placed, hosts, placement)
+        logger.info(
+            "Placed storages on SQL hosts by %s: %s",
+            placement,
+            ', '.join('%s=%s' % (storage, result[storage]) for storage in placed))
+        return result
+
+    def __create_replica_parts(self, storage, part_name, lookup):
+        """
+        Create the parts that write the replica files for *storage*
+        listed in ``sql_replicas`` and ``sql_ro_replicas`` (as found
+        by *lookup*), and return the settings for its ``<relstorage>``
+        section.
+
+        The replicas are hosts, optionally with a port. RelStorage
+        substitutes them for the host in the connection settings (for
+        PostgreSQL, in the DSN), so everything else is shared with the
+        primary.
+        """
+        settings = {}
+        for option, setting, suffix in (
+                ('sql_replicas', 'replica_conf', 'replicas'),
+                ('sql_ro_replicas', 'ro_replica_conf', 'ro_replicas'),
+        ):
+            replicas = (lookup(option) or '').split()
+            if not replicas:
+                continue
+            file_part = Part(
+                part_name + '_' + suffix,
+                recipe=self.file_recipe,
+                output=deployment.etc / 'relstorage' / (storage.lower() + '_' + suffix + '.conf'),
+                input=['inline:'] + replicas,
+            )
+            self._parse_file(file_part)
+            settings[setting] = hyphenated(SubstVar(file_part.name, 'output'))
+
+        if settings:
+            for setting in 'replica-timeout', 'revert-when-stale':
+                value = lookup(setting)
+                if value:
+                    settings[setting.replace('-', '_')] = hyphenated(value)
+        return settings
+
+    #: The settings of RelStorage's packing that are copied to
+    #: ``<relstorage>`` when set for all storages or for one.
+    pack_settings = (
+        'pack-batch-timeout',
+        'pack-commit-busy-delay',
+        'pack-duty-cycle',
+        'pack-max-delay',
+    )
+
+    def _pack_settings(self, lookup):
+        """
+        Return the keyword arguments for ``<relstorage>`` for the
+        :attr:`pack_settings` found by *lookup*.
+        """
+        settings = {}
+        for setting in self.pack_settings:
+            value = lookup(setting)
+            if value:
+                settings[setting.replace('-', '_')] = hyphenated(value)
+        return settings
 
     def _resolve(self, part, obj):
         if isinstance(obj, SubstVar):
@@ -241,6 +625,22 @@ class Databases(MultiStorageRecipe):
         for k in BaseStoragePart.sql_adapter_args.keys():
             sql_adapter_args.pop(k, None)
 
+    #: The PRAGMAs set for SQLite databases, and their defaults.
+    #: Each can be changed with the option ``sqlite_<pragma>``;
+    #: an empty value leaves it to SQLite and RelStorage.
+    sqlite3_pragmas = (
+        # Readers don't block the writer, or vice versa.
+        ('journal_mode', 'wal'),
+        # In WAL mode, this is still safe against corruption,
+        # though the last transactions may be lost if the
+        # machine (not just the process) crashes.
+        ('synchronous', 'normal'),
+        ('mmap_size', str(256 * 1024 * 1024)),
+        # Negative values are in KiB.
+        ('cache_size', str(-64 * 1024)),
+        ('temp_store', 'memory'),
+    )
+
     def _adapter_settings_for_sqlite3(self, part, sql_adapter_args):
         # sqlite resides on a single machine. No need to duplicate
         # blobs both in the DB and in the blob cache. This reduces parallel
@@ -251,11 +651,49 @@ class Databases(MultiStorageRecipe):
 
         # Top-level settings which we got by default have to go; there are none.
         self.__clear_top_level_inherited_adapter_settings(sql_adapter_args)
-        sql_adapter_args.addValue('data-dir', str(part['data_dir']) + '/' + part.name)
+        # Each storage gets a directory named for its part in the
+        # sqlite_data_dir, which can be set for each storage to put
+        # them on different disks.
+        data_dir = self._resolve(part, part.get('sqlite_data_dir')) or part['data_dir']
+        sql_adapter_args.addValue('data-dir', str(data_dir) + '/' + part.name)
+
+        pragmas = [
+            s for s in sql_adapter_args.sections
+            if s.type == 'pragmas'
+        ]
+        if pragmas:
+            pragmas = pragmas[0]
+        else:
+            pragmas = ZConfig.schemaless.Section('pragmas')
+        for pragma, default in self.sqlite3_pragmas:
+            value = self._resolve(part, part.get('sqlite_' + pragma))
+            if value is None:
+                value = default
+            # Those given in sql_adapter_extra_args win.
+            if value and pragma not in pragmas:
+                pragmas[pragma] = [str(value)]
+        if pragmas and pragmas not in sql_adapter_args.sections:
+            sql_adapter_args.sections.append(pragmas)
+
         return {
             'shared-blob-dir': True
         }
 
+    #: The connection parameters that can be added to a generated
+    #: PostgreSQL DSN with the option ``sql_<parameter>``. These are
+    #: numbers, and so are not quoted.
+    postgresql_dsn_parameters = (
+        'connect_timeout',
+        'keepalives_idle',
+        'keepalives_interval',
+        'keepalives_count',
+    )
+
+    #: The address of the connection pooler used when ``sql_pooler``
+    #: is set, unless given by ``sql_pooler_host`` and ``sql_pooler_port``.
+    postgresql_pooler_host = '127.0.0.1'
+    postgresql_pooler_port = 6432
+
     def _adapter_settings_for_postgresql(self, part, sql_adapter_args):
         # If no DSN is specified in the sql_adapter_args then we compute one.
         if 'dsn' in sql_adapter_args:
@@ -264,6 +702,13 @@ class Databases(MultiStorageRecipe):
         # put in empty fields and can use defaults.
         def resolve(obj):
             return self._resolve(part, obj)
+        def setting(name):
+            return resolve(part.get('sql_' + name))
+
+        pooler = setting('pooler')
+        if pooler and pooler != 'transaction':
+            raise UserError("Unknown sql_pooler %r; only 'transaction' is supported" % pooler)
+
         dsn = ' '
         for dsn_key, setting_key in (
                 ('dbname', 'db'),
@@ -271,18 +716,53 @@ class Databases(MultiStorageRecipe):
                 ('password', 'passwd'),
                 ('host', 'host')
         ):
-            setting = sql_adapter_args.pop(setting_key)[0]
-            setting = resolve(setting)
-            if setting:
-                dsn += "%s='%s' " % (dsn_key, setting)
+            value = sql_adapter_args.pop(setting_key)[0]
+            value = resolve(value)
+            if pooler and dsn_key == 'host':
+                value = setting('pooler_host') or self.postgresql_pooler_host
+            # A host beginning with a slash is the directory
+            # of a Unix socket; libpq handles that.
+            if value:
+                dsn += "%s=%s " % (dsn_key, _dsn_quote(value))
         dsn = dsn.strip()
 
         self.__clear_top_level_inherited_adapter_settings(sql_adapter_args)
 
+        port = None
         if 'sql_port' in sql_adapter_args:
+            port = resolve(sql_adapter_args.pop('sql_port')[0])
+        if pooler:
+            port = setting('pooler_port') or self.postgresql_pooler_port
+        if port:
             # Note no quotes
-            dsn += ' port=%s' % (resolve(sql_adapter_args['sql_port'][0]))
-            sql_adapter_args.pop('sql_port')
+            dsn += ' port=%s' % (port,)
+
+        parameters = [
+            (name, setting(name))
+            for name in self.postgresql_dsn_parameters
+        ]
+        if any(value for name, value in parameters if name.startswith('keepalives')):
+            dsn += ' keepalives=1'
+        for name, value in parameters:
+            if value:
+                dsn += ' %s=%s' % (name, value)
+
+        application_name = setting('application_name')
+        if application_name:
+            if '%s' in application_name:
+                application_name = application_name % (part['name'],)
+            dsn += ' application_name=%s' % (_dsn_quote(application_name),)
+
+        options = setting('options')
+        if options and pooler:
+            # Poolers like PgBouncer refuse startup parameters they
+            # don't know, and they wouldn't persist across the
+            # server connections of a transaction pool anyway.
+            logger.warning(
+                "Ignoring sql_options for %s behind a transaction pooler; "
+                "set them for the database role instead.", part['name'])
+        elif options:
+            dsn += ' options=%s' % (_dsn_quote(options),)
 
         sql_adapter_args.addValue('dsn', dsn)
         # No special settings to return, everything is in the mutated sql_adapter_args
@@ -292,6 +772,17 @@ class Databases(MultiStorageRecipe):
         # Our default is set up for MySQL
         return {}
 
+    #: Called with a module name to tell if a driver can be used.
+    sql_driver_importable = staticmethod(_importable)
+
+    def _select_sql_driver(self, adapter_name, sql_driver):
+        # Each storage usually asks for the same thing; only look once.
+        key = (adapter_name, sql_driver)
+        if key not in self._sql_drivers:
+            self._sql_drivers[key] = select_sql_driver(
+                adapter_name, sql_driver, self.sql_driver_importable)
+        return self._sql_drivers[key]
+
     def __adapter_settings(self, part):
         # sql adapter args could be dict-like if its our default template,
         # or it could be a string if it's specified by the user to replace our default
@@ -316,12 +807,16 @@ class Databases(MultiStorageRecipe):
             sql_adapter_args.sections.extend(config.sections)
 
         adapter_name = str(part.get('sql_adapter'))
+        sql_driver = self._resolve(part, part.get('sql_driver'))
+        # A driver given in the adapter args wins.
+        if sql_driver and 'driver' not in sql_adapter_args:
+            sql_adapter_args.addValue('driver', self._select_sql_driver(adapter_name, sql_driver))
         settings = getattr(self, '_adapter_settings_for_' + adapter_name)(part, sql_adapter_args)
 
         settings['sql_adapter_args'] = sql_adapter_args
         return settings
 
-    def __create_zodbconvert_parts(self, part):
+    def __create_zodbconvert_parts(self, part, compress_mode, compress_kwargs):
         # ZODB convert to and from files
 
         normalized_storage_name = part['name'].lower()
@@ -341,6 +836,7 @@ class Databases(MultiStorageRecipe):
             filestorage_name='destination',
             dump_name=normalized_storage_name,
             sql_db=part['name'],
+            **compress_kwargs
         )
         src_part = src_part.with_settings(**self.__adapter_settings(part))
         self._parse(src_part)
@@ -357,17 +853,34 @@ class Databases(MultiStorageRecipe):
         }
         to_relstorage_part = Part(
             to_relstorage_part_name,
-            recipe='collective.recipe.template',
+            recipe=self.file_recipe,
             output=Part.uses_name('${deployment:etc-directory}/relstorage/%s.xml'),
             input=[
                 'inline:',
-                self.zlibstorage_import(),
+                self.zlibstorage_import([compress_mode]),
                 '%import relstorage',
                 self.choice_ref(choices, 'storage_zcml'),
                 self.choice_ref(choices, 'filestorage_zcml'),
             ],
         )
-        self._parse(to_relstorage_part)
+        self._parse_file(to_relstorage_part)
 
         from_relstorage_part = to_relstorage_part.named(from_relstorage_part_name)
-        self._parse(from_relstorage_part)
+        self._parse_file(from_relstorage_part)
+
+        data_file = str(SubstVar(src_part_name, 'dump_dir')) + '/data.fs'
+        blob_dump_dir = str(SubstVar(src_part_name, 'blob_dump_dir'))
+        # Either way, what's copied is what ends up in the FileStorage.
+        return {
+            'name': str(SubstVar(part.name, 'name')),
+            'backup': {
+                'config': str(SubstVar(from_relstorage_part_name, 'output')),
+                'blobs': [str(SubstVar(part.name, 'blob_dir'))],
+                'size': [data_file, blob_dump_dir],
+            },
+            'restore': {
+                'config': str(SubstVar(to_relstorage_part_name, 'output')),
+                'blobs': [data_file, blob_dump_dir],
+                'size': [data_file, blob_dump_dir],
+            },
+        }
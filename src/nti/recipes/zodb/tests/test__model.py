@@ -45,6 +45,81 @@ class TestPart(unittest.TestCase):
         part = model.Part('part')
         self.assertIs(part.get('no-key', self), self)
 
+    def test_lookup_remembered(self):
+        base = model.Part('base', key='value')
+        part = model.Part('part', extends=(base,))
+        val = part['key']
+        assert_that(val.const, is_('value'))
+        assert_that(val.__parent__, is_(part))
+        self.assertIs(part['key'], val)
+        # The base didn't change
+        assert_that(base['key'].__parent__, is_(base))
+
+        with self.assertRaises(KeyError):
+            operator.itemgetter('missing')(part)
+        self.assertIn('missing', part._resolved)
+
+    def test_with_settings_forgets_lookups(self):
+        base = model.Part('base', key='value')
+        part = model.Part('part', extends=(base,))
+        val = part['key']
+
+        copy = part.with_settings(other='other')
+        copy_val = copy['key']
+        self.assertIsNot(copy_val, val)
+        assert_that(copy_val.__parent__, is_(copy))
+
+        named = part.named('named')
+        assert_that(named['key'].__parent__, is_(named))
+        # The original is unchanged
+        self.assertIs(part['key'], val)
+
+    def test_buildout_lookup(self):
+        part = model.Part('part', key='value')
+        assert_that(part.buildout_lookup('key').const, is_('value'))
+        self.assertIsNone(part.buildout_lookup('missing'))
+
+        part.buildout_lookup = {'key': 'other'}.get
+        assert_that(part.buildout_lookup('key'), is_('other'))
+        assert_that(part.with_settings(new='new').buildout_lookup('key'), is_('other'))
+
+    def test_no_instance_dict(self):
+        part = model.Part('part', key='value')
+        self.assertFalse(hasattr(part, '__dict__'))
+        self.assertFalse(hasattr(part['key'], '__dict__'))
+
+
+class TestValuesSchema(unittest.TestCase):
+
+    def test_schema_computed_once_per_class(self):
+        class Base(model.Part):
+            base_value = model.Default(1).hyphenate()
+
+        class Derived(Base):
+            derived_value = 'derived'
+
+        base_schema = Base._schema()
+        derived_schema = Derived._schema()
+        self.assertIsNot(base_schema, derived_schema)
+        self.assertIs(Base._schema(), base_schema)
+        self.assertIs(Derived._schema(), derived_schema)
+        assert_that(sorted(base_schema.defaults), is_(['base_value']))
+        assert_that(sorted(derived_schema.defaults),
+                    is_(['base_value', 'derived_value']))
+
+    def test_kwargs_translated(self):
+        class Hyphens(model.Part):
+            cls_value = model.Default(1).hyphenate()
+            renamed_value = model.renamed('renamed.value')
+
+        part = Hyphens('part', cls_value=2, renamed_value=3,
+                       const_value=model.hyphenated(4))
+        assert_that(sorted(part.keys()),
+                    is_(['cls-value', 'const-value', 'renamed.value']))
+        assert_that(part['cls-value'].const, is_(2))
+        assert_that(part['cls-value'].__name__, is_('cls-value'))
+        assert_that(part['cls-value'].__parent__, is_(part))
+
 
 class TestZConfigSnippet(unittest.TestCase):
 
@@ -52,6 +127,67 @@ class TestZConfigSnippet(unittest.TestCase):
         snip = model.ZConfigSnippet(key='')
         assert_that(str(snip), is_(''))
 
+class TestZConfigSection(unittest.TestCase):
+
+    def test_constant_rendered_once(self):
+        section = model.ZConfigSection(
+            'section', None,
+            model.ZConfigSection('inner', model.Ref('name'), key='value'),
+            path=model.Ref('part', 'dir') / 'file',
+            flag=True,
+        )
+        self.assertTrue(section.renders_constant())
+        expected = """\
+<section>
+    <inner ${:name}>
+      key value
+    </inner>
+  flag true
+  path ${part:dir}/file
+</section>"""
+        assert_that(str(section), is_(expected))
+        lines = section._render_cache['lines']
+        assert_that(str(section), is_(expected))
+        self.assertIs(section._render_cache['lines'], lines)
+
+        # Indentation comes from the container
+        part = model.Part('part', zcml=section)
+        assert_that(str(part), is_('[part]\nzcml = \n    '
+                                   + expected.replace('\n', '\n    ')))
+
+    def test_changes_invalidate(self):
+        section = model.ZConfigSection('section', None, key='value')
+        assert_that(str(section), is_('<section>\n  key value\n</section>'))
+        section['key'] = 'other'
+        assert_that(str(section), is_('<section>\n  key other\n</section>'))
+        del section['key']
+        assert_that(str(section), is_('<section>\n</section>'))
+
+        outer = model.ZConfigSection('outer', None, model.ZConfigSection('inner', None, key='value'))
+        assert_that(str(outer), is_('<outer>\n    <inner>\n      key value\n    </inner>\n</outer>'))
+        outer.sections[0]['key'] = 'changed'
+        assert_that(str(outer), is_('<outer>\n    <inner>\n      key changed\n    </inner>\n</outer>'))
+
+    def test_defaults_not_constant(self):
+        class section(model.ZConfigSection):
+            setting = model.Default(42)
+
+            def __init__(self):
+                model.ZConfigSection.__init__(self, 'section', None)
+
+        inner = section()
+        self.assertFalse(inner.renders_constant())
+        outer = model.ZConfigSection('outer', None, APPEND=inner)
+        self.assertFalse(outer.renders_constant())
+
+        part = model.Part('part', zcml=outer)
+        assert_that(str(part), is_(
+            '[part]\nzcml = \n    <outer>\n      <section>\n'
+            '        setting ${:setting}\n      </section>\n    </outer>\n'
+            'setting = 42'
+        ))
+
+
 class TestRef(unittest.TestCase):
 
     def test_rdiv(self):
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+__docformat__ = "restructuredtext en"
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from hamcrest import assert_that
+from hamcrest import is_
+
+from nti.recipes.zodb.files import File
+from nti.recipes.zodb.files import Manifest
+from nti.recipes.zodb.files import content_hash
+from nti.recipes.zodb.relstorage import Databases
+
+from . import default_buildout
+
+class _TempDirMixin(object):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _path(self, *names):
+        return os.path.join(self.temp_dir, *names)
+
+
+class TestFile(_TempDirMixin, unittest.TestCase):
+
+    def test_writes_only_changes(self):
+        output = self._path('etc', 'file.conf')
+        options = {'output': output, 'input': 'inline:\n\ncontent'}
+        File(None, 'file', options).install()
+        with open(output) as f:
+            assert_that(f.read(), is_('content'))
+
+        os.utime(output, (1, 1))
+        File(None, 'file', options).update()
+        assert_that(os.stat(output).st_mtime, is_(1))
+
+        options['input'] = 'inline:\nnew content'
+        File(None, 'file', options).update()
+        with open(output) as f:
+            assert_that(f.read(), is_('new content'))
+        self.assertNotEqual(os.stat(output).st_mtime, 1)
+        # No temporary files are left behind.
+        assert_that(os.listdir(self._path('etc')), is_(['file.conf']))
+
+    def test_mode(self):
+        output = self._path('file.conf')
+        options = {'output': output, 'input': 'inline:content'}
+        umask = os.umask(0o022)
+        try:
+            File(None, 'file', options).install()
+        finally:
+            os.umask(umask)
+        assert_that(stat.S_IMODE(os.stat(output).st_mode), is_(0o644))
+
+        # Changing the file keeps its mode.
+        os.chmod(output, 0o640)
+        options['input'] = 'inline:new content'
+        File(None, 'file', options).update()
+        assert_that(stat.S_IMODE(os.stat(output).st_mode), is_(0o640))
+
+
+class TestManifest(_TempDirMixin, unittest.TestCase):
+
+    def _manifest(self, files=('a_file',), **storages):
+        buildout = {
+            'a_file': {'output': self._path('a.conf'), 'input': 'inline:a'},
+            'b_file': {'output': self._path('b', 'b.conf'), 'input': 'inline:b'},
+        }
+        for section in files:
+            File(buildout, section, buildout[section]).install()
+        options = {
+            'output': self._path('manifest.json'),
+            'files': '\n'.join(files),
+            'storages': '\n'.join(sorted(storages)),
+            'servers': 'zeo',
+            'server-zeo': '<zeo>',
+        }
+        for name, config in storages.items():
+            options['storage-' + name] = config
+        Manifest(buildout, 'manifest', options).install()
+        with open(options['output']) as f:
+            return json.load(f)
+
+    def test_changed(self):
+        manifest = self._manifest(Users='users', Sessions='sessions')
+        assert_that(manifest['storages'], is_({
+            'Users': content_hash('users'),
+            'Sessions': content_hash('sessions'),
+        }))
+        assert_that(manifest['files'], is_({
+            self._path('a.conf'): content_hash('a')
+        }))
+        assert_that(manifest['changed'], is_({
+            'files': [self._path('a.conf')],
+            'storages': ['Sessions', 'Users'],
+            'servers': ['zeo'],
+        }))
+
+        manifest = self._manifest(Users='users', Sessions='sessions')
+        assert_that(manifest['changed'], is_({
+            'files': [],
+            'storages': [],
+            'servers': [],
+        }))
+
+        # Change one, remove one, add one
+        manifest = self._manifest(Users='other users', Other='other')
+        assert_that(manifest['changed'], is_({
+            'files': [],
+            'storages': ['Other', 'Sessions', 'Users'],
+            'servers': [],
+        }))
+
+    def test_removes_files(self):
+        self._manifest(files=('a_file', 'b_file'))
+        self.assertTrue(os.path.exists(self._path('b', 'b.conf')))
+
+        manifest = self._manifest(files=('a_file',))
+        assert_that(manifest['changed']['files'], is_([self._path('b', 'b.conf')]))
+        self.assertFalse(os.path.exists(self._path('b', 'b.conf')))
+        # The directory may not be ours, so it stays.
+        self.assertTrue(os.path.isdir(self._path('b')))
+        self.assertTrue(os.path.exists(self._path('a.conf')))
+
+
+class TestDatabasesManifest(unittest.TestCase):
+
+    def test_manifest_part(self):
+        buildout = default_buildout()
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'write-zodbconvert': 'true',
+        })
+        manifest = buildout['zodb_manifest']
+        assert_that(manifest['recipe'], is_('nti.recipes.zodb:manifest'))
+        assert_that(manifest['output'], is_('/etc/zodb_manifest.json'))
+        assert_that(manifest['storages'].split(), is_(['Users', 'Sessions']))
+        assert_that(manifest['storage-Users'],
+                    is_(buildout['relstorages_users_storage']['client_zcml']))
+        assert_that(manifest['files'].split(), is_([
+            'users_to_relstorage_conf',
+            'users_from_relstorage_conf',
+            'sessions_to_relstorage_conf',
+            'sessions_from_relstorage_conf',
+            'zodb_conf',
+            'zodb_uri_conf',
+        ]))
+        assert_that(buildout['zodb_conf']['recipe'], is_('nti.recipes.zodb:file'))
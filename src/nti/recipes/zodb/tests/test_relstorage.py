@@ -6,12 +6,17 @@ __docformat__ = "restructuredtext en"
 import textwrap
 import unittest
 
+from zc.buildout import UserError
+
 
 from hamcrest import is_not
 from hamcrest import assert_that
 from hamcrest import contains_string
 
 from nti.recipes.zodb.relstorage import Databases
+from nti.recipes.zodb.relstorage import allocate_cache_budget
+from nti.recipes.zodb.relstorage import select_sql_driver
+from nti.recipes.zodb.relstorage import place_storages
 
 from . import default_buildout
 
@@ -403,6 +408,33 @@ class TestDatabases(unittest.TestCase):
         )
 
 
+    def test_parse_batched(self):
+        parsed = []
+        def parse(data, _parse=self.buildout.parse):
+            parsed.append(data)
+            return _parse(data)
+        self.buildout.parse = parse
+
+        Databases(self.buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'write-zodbconvert': 'true',
+        })
+        self.assertEqual(len(parsed), 1)
+
+        class Unbatched(Databases):
+            batch_parse = False
+
+        unbatched_buildout = setup_buildout_environment()
+        Unbatched(unbatched_buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'write-zodbconvert': 'true',
+        })
+        self.assertEqual(list(self.buildout), list(unbatched_buildout))
+        for section in unbatched_buildout:
+            self.assertEqual(
+                dict(self.buildout[section]),
+                dict(unbatched_buildout[section]))
+
     def test_parse_no_secondary_cache(self):
         # No verification, just sees if it runs
         buildout = self.buildout
@@ -468,6 +500,14 @@ class TestDatabases(unittest.TestCase):
         <sqlite3>
           # This comment preserves whitespace
           data-dir /data/relstorages_users_storage
+
+          <pragmas>
+            cache_size -65536
+            journal_mode wal
+            mmap_size 268435456
+            synchronous normal
+            temp_store memory
+          </pragmas>
         </sqlite3>
       blob-dir /data/Users.blobs
       cache-local-dir /caches/data_cache/Users.cache
@@ -499,7 +539,11 @@ class TestDatabases(unittest.TestCase):
           driver gevent sqlite
 
           <pragmas>
+            cache_size -65536
+            journal_mode wal
+            mmap_size 268435456
             synchronous off
+            temp_store memory
           </pragmas>
         </sqlite3>
       blob-dir /data/Sessions.blobs
@@ -532,3 +576,440 @@ class TestDatabases(unittest.TestCase):
                     contains_string('data-dir /data/relstorages_sessions_storage'))
         assert_that(buildout['sessions_from_relstorage_conf']['input'],
                     contains_string('data-dir /data/relstorages_sessions_storage'))
+
+    def test_parse_cache_memory_budget(self):
+        buildout = self.buildout
+        buildout['relstorages_users_storage_opts']['cache-weight'] = '3'
+        buildout['relstorages_sessions_storage_opts'] = {
+            'cache_local_mb': '100',
+        }
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions Other',
+            'cache-memory-budget': '1gb',
+        })
+
+        def cache_local_mb(storage):
+            zcml = buildout['relstorages_' + storage + '_storage']['client_zcml']
+            return [l.strip() for l in zcml.splitlines() if 'cache-local-mb' in l]
+
+        self.assertEqual(cache_local_mb('users'), ['cache-local-mb 693'])
+        self.assertEqual(cache_local_mb('sessions'), ['cache-local-mb 100'])
+        self.assertEqual(cache_local_mb('other'), ['cache-local-mb 231'])
+
+    def test_parse_cache_memory_budget_suffixes(self):
+        buildout = self.buildout
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'cache-memory-budget': '0.001tb',
+        })
+        assert_that(buildout['relstorages_users_storage']['client_zcml'],
+                    contains_string('cache-local-mb 524'))
+
+    def test_parse_cache_memory_budget_invalid(self):
+        for budget, opts in (
+                ('lots', {}),
+                ('1pb', {}),
+                ('-1gb', {}),
+                ('1gb', {'cache_local_mb': 'big'}),
+                ('1gb', {'cache-weight': 'heavy'}),
+                ('1gb', {'cache-weight': '0'}),
+        ):
+            buildout = default_buildout(default_sections=dict(
+                relstorages_users_storage_opts=opts,
+            ))
+            with self.assertRaises(UserError):
+                Databases(buildout, 'relstorages', {
+                    'storages': 'Users Sessions',
+                    'cache-memory-budget': budget,
+                })
+
+    def test_parse_worker_concurrency(self):
+        buildout = self.buildout
+        buildout['relstorages_opts']['pool_timeout'] = '1m'
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'worker-concurrency': '16',
+        })
+        for storage in 'users', 'sessions':
+            zcml = buildout['relstorages_' + storage + '_storage']['client_zcml']
+            assert_that(zcml, contains_string('pool-size 16'))
+            assert_that(zcml, contains_string('pool-timeout 1m'))
+
+    def test_parse_optional_zodb_settings(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_users_storage_opts={
+                'historical_pool_size': '1',
+            },
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'historical-timeout': '1m',
+        })
+        users = buildout['relstorages_users_storage']['client_zcml']
+        assert_that(users, contains_string('historical-pool-size 1'))
+        assert_that(users, contains_string('historical-timeout 1m'))
+        sessions = buildout['relstorages_sessions_storage']['client_zcml']
+        assert_that(sessions, contains_string('historical-pool-size 3'))
+        assert_that(sessions, contains_string('historical-timeout 1m'))
+        assert_that(sessions, is_not(contains_string('cache-size-bytes')))
+
+    def test_parse_replicas(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_users_storage_opts={
+                'sql_replicas': 'replica1:5433 replica2',
+                'sql_ro_replicas': 'ro_replica',
+            },
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'sql_adapter': 'postgresql',
+            'sql_host': 'primary',
+            'replica-timeout': '600',
+            'revert-when-stale': 'true',
+        })
+        users = buildout['relstorages_users_storage']['client_zcml']
+        assert_that(users, contains_string("dsn dbname='Users' host='primary'"))
+        assert_that(users, contains_string(
+            'replica-conf /etc/relstorage/users_replicas.conf'))
+        assert_that(users, contains_string(
+            'ro-replica-conf /etc/relstorage/users_ro_replicas.conf'))
+        assert_that(users, contains_string('replica-timeout 600'))
+        assert_that(users, contains_string('revert-when-stale true'))
+
+        replicas = buildout['relstorages_users_storage_replicas']
+        self.assertEqual(replicas['recipe'], 'nti.recipes.zodb:file')
+        self.assertEqual(replicas['input'], 'inline:\nreplica1:5433\nreplica2')
+
+        sessions = buildout['relstorages_sessions_storage']['client_zcml']
+        assert_that(sessions, is_not(contains_string('replica')))
+        self.assertNotIn('relstorages_sessions_storage_replicas', buildout)
+
+    def test_parse_sqlite_options(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_opts={
+                'sql_adapter': 'sqlite3',
+                'sqlite_synchronous': 'full',
+            },
+            relstorages_users_storage_opts={
+                'sqlite_data_dir': '/disk2',
+                'sqlite_mmap_size': '',
+            },
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+        })
+        users = buildout['relstorages_users_storage']['client_zcml']
+        assert_that(users, contains_string('data-dir /disk2/relstorages_users_storage'))
+        assert_that(users, contains_string('synchronous full'))
+        assert_that(users, is_not(contains_string('mmap_size')))
+        sessions = buildout['relstorages_sessions_storage']['client_zcml']
+        assert_that(sessions, contains_string('data-dir /data/relstorages_sessions_storage'))
+        assert_that(sessions, contains_string('mmap_size 268435456'))
+
+
+    def _postgres_dsn(self, storage='Users', **opts):
+        opts.setdefault('sql_adapter', 'postgresql')
+        buildout = default_buildout(default_sections=dict(
+            relstorages_opts=opts,
+            relstorages_users_storage_opts={'sql_host': '/var/run/postgresql'},
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+        })
+        zcml = buildout['relstorages_%s_storage' % storage.lower()]['client_zcml']
+        dsn, = [l.strip() for l in zcml.splitlines() if l.strip().startswith('dsn ')]
+        return dsn
+
+    def test_parse_postgres_dsn_options(self):
+        dsn = self._postgres_dsn(
+            sql_connect_timeout='5',
+            sql_keepalives_idle='30',
+            sql_application_name='app:%s',
+            sql_options='-c statement_timeout=5000',
+            sql_passwd="it's",
+        )
+        self.assertEqual(
+            dsn,
+            "dsn dbname='Users' password='it\\'s' host='/var/run/postgresql'"
+            " keepalives=1 connect_timeout=5 keepalives_idle=30"
+            " application_name='app:Users' options='-c statement_timeout=5000'"
+        )
+
+    def test_parse_postgres_dsn_pooler(self):
+        dsn = self._postgres_dsn(
+            'Sessions',
+            sql_pooler='transaction',
+            sql_options='-c statement_timeout=5000',
+        )
+        self.assertEqual(
+            dsn,
+            "dsn dbname='Sessions' host='127.0.0.1' port=6432"
+        )
+
+        dsn = self._postgres_dsn(
+            'Sessions',
+            sql_pooler='transaction',
+            sql_pooler_host='/var/run/pgbouncer',
+            sql_pooler_port='6000',
+        )
+        self.assertEqual(
+            dsn,
+            "dsn dbname='Sessions' host='/var/run/pgbouncer' port=6000"
+        )
+
+        with self.assertRaises(UserError):
+            self._postgres_dsn(sql_pooler='session')
+
+
+    def test_parse_sql_driver(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_opts={
+                'sql_adapter': 'sqlite3',
+                'sql_driver': 'auto',
+            },
+            relstorages_users_storage_opts={
+                'sql_adapter_extra_args': 'driver gevent sqlite3',
+            },
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+        })
+        users = buildout['relstorages_users_storage']['client_zcml']
+        assert_that(users, contains_string('driver gevent sqlite3'))
+        sessions = buildout['relstorages_sessions_storage']['client_zcml']
+        assert_that(sessions, contains_string('driver sqlite3'))
+
+        class WithoutPsycopg2(Databases):
+            sql_driver_importable = staticmethod(lambda module: module != 'psycopg2')
+
+        buildout = default_buildout(default_sections=dict(
+            relstorages_opts={
+                'sql_adapter': 'postgresql',
+                'sql_driver': 'psycopg2',
+            },
+        ))
+        with self.assertRaises(UserError):
+            WithoutPsycopg2(buildout, 'relstorages', {
+                'storages': 'Users',
+            })
+
+
+    def test_sql_hosts(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_users_2_storage_opts={'sql_host': 'other'},
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users_1 Users_2 Users_3 Users_4',
+            'sql_hosts': 'db1 db2',
+            'sql_adapter': 'postgresql',
+        })
+        hosts = [
+            buildout['relstorages_users_%d_storage' % i]['sql_host']
+            for i in range(1, 5)
+        ]
+        self.assertEqual(hosts, ['db1', 'other', 'db2', 'db1'])
+        assert_that(buildout['relstorages_users_3_storage']['client_zcml'],
+                    contains_string("host='db2'"))
+
+    def test_sql_hosts_invalid(self):
+        for sql_hosts in 'db1=heavy', 'db1=0', '=2', 'db1:5432', '[::1]:5432':
+            with self.assertRaises(UserError):
+                Databases(default_buildout(), 'relstorages', {
+                    'storages': 'Users',
+                    'sql_hosts': sql_hosts,
+                })
+
+
+    def test_parse_shards(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_users_shards_storage_opts={'sql_adapter': 'postgresql'},
+            relstorages_users_02_storage_opts={'sql_adapter': 'sqlite3'},
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users_{01..12}',
+            'sql_hosts': 'db1 db2',
+        })
+        self.assertEqual(
+            buildout['relstorages_users_01_storage']['sql_adapter'], 'postgresql')
+        self.assertEqual(
+            buildout['relstorages_users_02_storage']['sql_adapter'], 'sqlite3')
+        self.assertEqual(
+            buildout['relstorages_users_12_storage']['sql_host'], 'db2')
+
+
+    def test_parse_storage_compress(self):
+        buildout = default_buildout(default_sections=dict(
+            relstorages_sessions_storage_opts={'compress': 'compress'},
+        ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+            'write-zodbconvert': 'true',
+        })
+        self.assertNotIn('zlibstorage', buildout['relstorages_users_storage']['client_zcml'])
+        sessions = buildout['relstorages_sessions_storage']['client_zcml']
+        assert_that(sessions, contains_string('<zlibstorage Sessions>'))
+        self.assertNotIn('compress false', sessions)
+        self.assertIn('%import zc.zlibstorage', buildout['zodb_conf']['input'])
+        self.assertIn('%import zc.zlibstorage', buildout['sessions_to_relstorage_conf']['input'])
+        self.assertIn('<zlibstorage destination>',
+                      buildout['sessions_to_relstorage_conf']['input'])
+        self.assertNotIn('zlibstorage', buildout['users_to_relstorage_conf']['input'])
+
+
+    def test_zodbconvert_script(self):
+        buildout = default_buildout()
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users',
+            'write-zodbconvert': 'true',
+        })
+        part = buildout['relstorages_zodbconvert']
+        self.assertEqual(part['recipe'], 'zc.recipe.egg:scripts')
+        self.assertEqual(part['entry-points'],
+                         'relstorages-zodbconvert=nti.recipes.zodb.zodbconvert:main')
+        storages, zodbconvert = eval(part['arguments']) # pylint:disable=eval-used
+        self.assertEqual(zodbconvert, buildout['buildout']['bin-directory'] + '/zodbconvert')
+        dump = ['/data/relstorage_dump/users/data.fs', '/data/relstorage_dump/users/blobs']
+        self.assertEqual(storages, [{
+            'name': 'Users',
+            'backup': {
+                'config': '/etc/relstorage/users_from_relstorage_conf.xml',
+                'blobs': ['/data/Users.blobs'],
+                'size': dump,
+            },
+            'restore': {
+                'config': '/etc/relstorage/users_to_relstorage_conf.xml',
+                'blobs': dump,
+                'size': dump,
+            },
+        }])
+
+    def test_batch_parse_keeps_order(self):
+        class Unbatched(Databases):
+            batch_parse = False
+
+        class Batched(Databases):
+            batch_parse = True
+
+        def sections(kind):
+            buildout = default_buildout()
+            kind(buildout, 'relstorages', {
+                'storages': 'Users Sessions',
+                'write-zodbconvert': 'true',
+            })
+            return list(buildout)
+
+        self.assertEqual(sections(Batched), sections(Unbatched))
+
+    def test_zodbpack(self):
+        buildout = default_buildout(
+            deployment={'user': 'zope', 'crontab-directory': '/etc/cron.d'},
+            default_sections=dict(
+                relstorages_users_storage_opts={
+                    'pack-days': '7',
+                    'pack-batch-timeout': '2.5',
+                },
+            ))
+        Databases(buildout, 'relstorages', {
+            'storages': 'Users Sessions Other',
+            'sql_hosts': 'db1 db2',
+            'write-zodbpack': 'true',
+            'pack-window': '23:00-03:00',
+            'pack-duty-cycle': '0.5',
+        })
+        users = buildout['users_zodbpack_conf']
+        self.assertEqual(users['output'], '/etc/zodbpack/users.xml')
+        assert_that(users['input'], contains_string('%import relstorage'))
+        assert_that(users['input'], contains_string('pack-batch-timeout 2.5'))
+        assert_that(users['input'], contains_string('pack-duty-cycle 0.5'))
+        self.assertNotIn('pack-batch-timeout',
+                         buildout['sessions_zodbpack_conf']['input'])
+
+        crontab = buildout['relstorages_zodbpack_crontab']
+        self.assertEqual(crontab['output'], '/etc/cron.d/relstorages-zodbpack')
+        zodbpack = buildout['buildout']['bin-directory'] + '/zodbpack'
+        # Users and Other share db1, so they're two hours apart.
+        self.assertEqual(crontab['input'].splitlines()[2:], [
+            '0 23 * * * zope %s -d 7 /etc/zodbpack/users.xml' % zodbpack,
+            '0 23 * * * zope %s -d 0 /etc/zodbpack/sessions.xml' % zodbpack,
+            '0 1 * * * zope %s -d 0 /etc/zodbpack/other.xml' % zodbpack,
+        ])
+
+
+class TestAllocateCacheBudget(unittest.TestCase):
+
+    def test_weights(self):
+        self.assertEqual(
+            allocate_cache_budget(1000, {'a': 1, 'b': 1, 'c': 2}),
+            {'a': 250, 'b': 250, 'c': 500})
+
+    def test_explicit_wins(self):
+        self.assertEqual(
+            allocate_cache_budget(1000, {'a': 1, 'b': 1}, {'c': 600}),
+            {'a': 200, 'b': 200, 'c': 600})
+
+    def test_over_budget(self):
+        self.assertEqual(
+            allocate_cache_budget(100, {'a': 1}, {'c': 600}),
+            {'a': 0, 'c': 600})
+
+
+class TestSelectSQLDriver(unittest.TestCase):
+
+    def _select(self, adapter, requested, *modules):
+        return select_sql_driver(adapter, requested, modules.__contains__)
+
+    def test_auto(self):
+        self.assertEqual(
+            self._select('mysql', 'auto', 'MySQLdb', 'pymysql', 'gevent'),
+            'MySQLdb')
+        self.assertEqual(
+            self._select('mysql', 'auto', 'mysql.connector', 'pymysql'),
+            'PyMySQL')
+        self.assertEqual(
+            self._select('postgresql', 'auto', 'pg8000', 'psycopg2cffi'),
+            'psycopg2cffi')
+
+    def test_gevent_auto(self):
+        self.assertEqual(
+            self._select('postgresql', 'gevent auto', 'psycopg2', 'gevent'),
+            'gevent psycopg2')
+        with self.assertRaises(UserError):
+            self._select('postgresql', 'gevent auto', 'psycopg2')
+
+    def test_named(self):
+        self.assertEqual(
+            self._select('postgresql', 'pg8000', 'pg8000', 'psycopg2'),
+            'pg8000')
+        with self.assertRaises(UserError):
+            self._select('postgresql', 'pg8000', 'psycopg2')
+        with self.assertRaises(UserError):
+            self._select('postgresql', 'MySQLdb', 'MySQLdb')
+
+
+class TestPlaceStorages(unittest.TestCase):
+
+    storages = ['Users_%d' % i for i in range(40)]
+
+    def test_round_robin(self):
+        self.assertEqual(
+            place_storages(['a', 'b', 'c'], [('db1', 1), ('db2', 5)]),
+            {'a': 'db1', 'b': 'db2', 'c': 'db1'})
+
+    def test_weighted(self):
+        placed = place_storages(self.storages, [('db1', 3), ('db2', 1)], 'weighted')
+        self.assertEqual(list(placed.values()).count('db1'), 30)
+        self.assertEqual(list(placed.values()).count('db2'), 10)
+
+    def test_hash_is_consistent(self):
+        hosts = [('db1', 1), ('db2', 1), ('db3', 1)]
+        placed = place_storages(self.storages, hosts, 'hash')
+        self.assertEqual(set(placed.values()), {'db1', 'db2', 'db3'})
+        fewer = place_storages(self.storages, hosts[:2], 'hash')
+        for storage, host in placed.items():
+            if host != 'db3':
+                self.assertEqual(fewer[storage], host)
+
+    def test_unknown(self):
+        with self.assertRaises(UserError):
+            place_storages(['a'], [('db1', 1)], 'random')
@@ -8,7 +8,12 @@ __docformat__ = "restructuredtext en"
 
 import unittest
 
+from zc.buildout import UserError
+
+from nti.recipes.zodb import expand_storage_names
+from nti.recipes.zodb import pack_start_times
 from nti.recipes.zodb.zeo import Databases
+from nti.recipes.zodb.zeo import _nth_address
 from . import default_buildout
 
 class TestDatabases(unittest.TestCase):
@@ -233,3 +238,559 @@ class TestDatabases(unittest.TestCase):
         self.assertEqual(
             buildout['users_1_client']['client_zcml'],
             expected)
+
+    def test_parse_multiple_servers(self):
+        buildout = self.buildout
+        buildout['sessions_storage_opts'] = {
+            'zeo-server': '1',
+        }
+
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Users_1 Sessions',
+            'compress': 'none',
+            'zeo-servers': '2',
+        })
+
+        self.assertNotIn('base_zeo', buildout)
+        self.assertEqual(buildout['base_zeo_1']['name'], 'zeo_1')
+        self.assertEqual(buildout['base_zeo_2']['name'], 'zeo_2')
+        self.assertEqual(buildout['users_client']['zeo_address'], '/var/zeosocket_1')
+        self.assertEqual(buildout['users_1_client']['zeo_address'], '/var/zeosocket_2')
+        self.assertEqual(buildout['sessions_client']['zeo_address'], '/var/zeosocket_1')
+        self.assertIn('server /var/zeosocket_2', buildout['users_1_client']['client_zcml'])
+
+        expected = """\
+<zeo>
+  address /var/zeosocket_2
+</zeo>
+<filestorage 2>
+  blob-dir /data/Users_1.blobs
+  pack-gc false
+  path /data/Users_1.fs
+</filestorage>
+<eventlog>
+    <logfile>
+      format %(asctime)s %(message)s
+      level DEBUG
+      path /var/log/zeo_2.log
+    </logfile>
+</eventlog>"""
+        self.assertEqual(
+            buildout['base_zeo_2']['zeo.conf'],
+            expected
+        )
+        self.assertIn('<filestorage 3>', buildout['base_zeo_1']['zeo.conf'])
+        self.assertEqual(buildout['zodb_manifest']['servers'].split(),
+                         ['zeo_1', 'zeo_2'])
+
+    def test_parse_more_servers_than_storages(self):
+        buildout = self.buildout
+        Databases(buildout, 'zeo', {
+            'storages': 'Users',
+            'zeo-servers': '2',
+        })
+        self.assertIn('base_zeo_1', buildout)
+        self.assertNotIn('base_zeo_2', buildout)
+
+    def test_parse_tcp_not_shared(self):
+        buildout = self.buildout
+        buildout['users_client_opts'] = {
+            'blob-cache-size': '5mb',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+            'zeo-servers': '2',
+            'zeo-address': '0.0.0.0:8100',
+            'zeo-client-address': 'localhost:8100',
+            'shared-blob-dir': 'false',
+            'blob-cache-size': '1gb',
+        })
+
+        expected = """\
+<zodb Sessions>
+  cache-size 100000
+  database-name Sessions
+  pool-size 60
+  <zeoclient>
+    blob-cache-size 1gb
+    blob-dir /caches/Sessions.blobs
+    name Sessions
+    server localhost:8101
+    shared-blob-dir false
+    storage 2
+  </zeoclient>
+</zodb>"""
+        self.assertEqual(
+            buildout['sessions_client']['client_zcml'],
+            expected)
+        self.assertIn('blob-cache-size 5mb', buildout['users_client']['client_zcml'])
+        self.assertIn('server localhost:8100', buildout['users_client']['client_zcml'])
+        self.assertIn('address 0.0.0.0:8100', buildout['base_zeo_1']['zeo.conf'])
+        self.assertIn('address 0.0.0.0:8101', buildout['base_zeo_2']['zeo.conf'])
+        self.assertIn('/caches/Users.blobs', buildout['zeo_mkdirs']['paths'])
+
+    def test_parse_client_blob_cache_size(self):
+        buildout = self.buildout
+        buildout['users_client_opts'] = {
+            'blob-cache-size': '5mb',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'shared-blob-dir': 'false',
+        })
+        self.assertIn('blob-cache-size 5mb', buildout['users_client']['client_zcml'])
+        self.assertNotIn('blob-cache-size', buildout['sessions_client']['client_zcml'])
+
+    def test_parse_tcp_single_server(self):
+        buildout = self.buildout
+        Databases(buildout, 'zeo', {
+            'storages': 'Users',
+            'zeo-address': '8100',
+        })
+        self.assertIn('address 8100', buildout['base_zeo']['zeo.conf'])
+        self.assertIn('server 8100', buildout['users_client']['client_zcml'])
+        # The blob directory is shared by default.
+        self.assertIn('shared-blob-dir true', buildout['users_client']['client_zcml'])
+        self.assertNotIn('blob-cache-size', buildout['users_client']['client_zcml'])
+
+    def test_invalid_options(self):
+        for options in (
+                {'zeo-servers': '0'},
+                {'zeo-servers': 'two'},
+                {'compress-on': 'sometimes'},
+                {'worker-concurrency': '0'},
+        ):
+            options['storages'] = 'Users'
+            with self.assertRaises(UserError):
+                Databases(default_buildout(), 'zeo', options)
+
+        buildout = self.buildout
+        buildout['users_storage_opts'] = {
+            'zeo-server': '3',
+        }
+        with self.assertRaises(UserError):
+            Databases(buildout, 'zeo', {
+                'storages': 'Users',
+                'zeo-servers': '2',
+            })
+
+    def test_nth_address(self):
+        self.assertEqual(_nth_address('localhost:8100', 0), 'localhost:8100')
+        self.assertEqual(_nth_address('localhost:8100', 2), 'localhost:8102')
+        self.assertEqual(_nth_address('8100', 1), '8101')
+        self.assertEqual(_nth_address('/var/zeosocket', 1), '/var/zeosocket_2')
+
+    def test_parse_client_cache(self):
+        buildout = self.buildout
+        buildout['zeo_opts'] = {
+            'zeo-cache-size': '200MB',
+        }
+        buildout['users_storage_opts'] = {
+            'zeo-cache-persistent': 'true',
+            'drop-cache-rather-verify': 'true',
+        }
+        buildout['users_client_opts'] = {
+            'wait': 'false',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+        })
+
+        expected = """\
+<zodb Users>
+  cache-size 100000
+  database-name Users
+  pool-size 60
+  <zeoclient>
+    blob-dir /data/Users.blobs
+    cache-size 200MB
+    client Users
+    drop-cache-rather-verify true
+    name Users
+    server /var/zeosocket
+    shared-blob-dir true
+    storage 1
+    var /caches/zeo
+    wait false
+  </zeoclient>
+</zodb>"""
+        self.assertEqual(
+            buildout['users_client']['client_zcml'],
+            expected)
+
+        sessions = buildout['sessions_client']['client_zcml']
+        self.assertIn('cache-size 200MB', sessions)
+        self.assertNotIn('client Sessions', sessions)
+        self.assertNotIn('wait', sessions)
+        self.assertIn('/caches/zeo', buildout['zeo_mkdirs']['paths'])
+
+    def test_parse_server_settings(self):
+        buildout = self.buildout
+        buildout['zeo_opts'] = {
+            'invalidation-queue-size': '10000',
+        }
+        buildout['zeo_2_opts'] = {
+            'invalidation-age': '3600',
+            'read-only': 'true',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+            'zeo-servers': '2',
+            'transaction-timeout': '30',
+        })
+
+        conf = buildout['base_zeo_2']['zeo.conf']
+        self.assertTrue(conf.startswith("""\
+<zeo>
+  address /var/zeosocket_2
+  invalidation-age 3600
+  invalidation-queue-size 10000
+  read-only true
+  transaction-timeout 30
+</zeo>
+"""), conf)
+
+        conf = buildout['base_zeo_1']['zeo.conf']
+        self.assertTrue(conf.startswith("""\
+<zeo>
+  address /var/zeosocket_1
+  invalidation-queue-size 10000
+  transaction-timeout 30
+</zeo>
+"""), conf)
+
+    def test_parse_worker_concurrency(self):
+        buildout = self.buildout
+        buildout['sessions_client_opts'] = {
+            'pool_size': '4',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'worker-concurrency': '16',
+        })
+        users = buildout['users_client']['client_zcml']
+        self.assertIn('pool-size 16', users)
+        self.assertIn('pool-timeout 10m', users)
+        self.assertIn('pool-size 4', buildout['sessions_client']['client_zcml'])
+
+    def test_parse_pool_size_client_settings(self):
+        # Clients with their own <zodb> keep an explicit pool_size,
+        # with or without worker-concurrency.
+        for worker_options in {}, {'worker-concurrency': '8'}:
+            buildout = default_buildout()
+            buildout['users_client_opts'] = {
+                'pool_size': '7',
+                'zeo-cache-size': '200MB',
+            }
+            buildout['sessions_storage_opts'] = {
+                'pool_size': '9',
+                'compress': 'none',
+            }
+            options = {'storages': 'Users Sessions Other'}
+            options.update(worker_options)
+            Databases(buildout, 'zeo', options)
+            self.assertIn('pool-size 7', buildout['users_client']['client_zcml'])
+            self.assertIn('pool-size 9', buildout['sessions_client']['client_zcml'])
+            self.assertIn('pool-size 8' if worker_options else 'pool-size 60',
+                          buildout['other_client']['client_zcml'])
+
+    def test_parse_pool_timeout_client_settings(self):
+        buildout = self.buildout
+        buildout['users_client_opts'] = {
+            'zeo-cache-size': '200MB',
+        }
+        buildout['other_client_opts'] = {
+            'zeo-cache-size': '200MB',
+            'pool_timeout': '1m',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions Other',
+            'pool_timeout': '5m',
+        })
+        self.assertIn('pool-timeout 5m', buildout['users_client']['client_zcml'])
+        self.assertIn('pool-timeout 5m', buildout['sessions_client']['client_zcml'])
+        self.assertIn('pool-timeout 1m', buildout['other_client']['client_zcml'])
+
+    def test_parse_worker_concurrency_client_settings(self):
+        # Clients with their own <zodb> still follow the plan.
+        buildout = self.buildout
+        buildout['users_client_opts'] = {
+            'zeo-cache-size': '200MB',
+        }
+        buildout['sessions_storage_opts'] = {
+            'compress': 'none',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions Other',
+            'worker-concurrency': '8',
+        })
+        for client in 'users_client', 'sessions_client', 'other_client':
+            zcml = buildout[client]['client_zcml']
+            self.assertIn('pool-size 8', zcml)
+            self.assertIn('pool-timeout 10m', zcml)
+        self.assertIn('cache-size 200MB', buildout['users_client']['client_zcml'])
+
+    def test_parse_optional_zodb_settings(self):
+        buildout = self.buildout
+        buildout['users_client_opts'] = {
+            'large_record_size': '1MB',
+        }
+        buildout['zeo_opts'] = {
+            'cache-size-bytes': '100MB',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+        })
+
+        expected = """\
+<zodb Users>
+  cache-size 100000
+  cache-size-bytes 100MB
+  database-name Users
+  large-record-size 1MB
+  pool-size 60
+  <zeoclient>
+    blob-dir /data/Users.blobs
+    name Users
+    server /var/zeosocket
+    shared-blob-dir true
+    storage 1
+  </zeoclient>
+</zodb>"""
+        self.assertEqual(buildout['users_client']['client_zcml'], expected)
+        # Others get ZODB's default.
+        self.assertIn('large-record-size 16MB', buildout['sessions_client']['client_zcml'])
+        self.assertNotIn('historical', buildout['sessions_client']['client_zcml'])
+
+    def test_expand_storage_names(self):
+        self.assertEqual(
+            expand_storage_names('Users Users_{1..3} Log{08..10}-old'),
+            [('Users', None),
+             ('Users_1', 'Users'), ('Users_2', 'Users'), ('Users_3', 'Users'),
+             ('Log08-old', 'Log-old'), ('Log09-old', 'Log-old'), ('Log10-old', 'Log-old')])
+        self.assertEqual(expand_storage_names('Users_{2..2}'), [('Users_2', 'Users')])
+        with self.assertRaises(UserError):
+            expand_storage_names('Users_{5..1} Sessions')
+        with self.assertRaises(UserError):
+            expand_storage_names('Users_{1..2}{3..4}')
+
+    def test_parse_shards(self):
+        buildout = self.buildout
+        buildout['users_shards_client_opts'] = {
+            'pool_size': '4',
+        }
+        buildout['users_2_client_opts'] = {
+            'pool_size': '8',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users_{1..3} Sessions',
+        })
+        self.assertIn('storage 3', buildout['users_3_client']['client_zcml'])
+        self.assertIn('pool-size 4', buildout['users_1_client']['client_zcml'])
+        self.assertIn('pool-size 8', buildout['users_2_client']['client_zcml'])
+        self.assertIn('pool-size 60', buildout['sessions_client']['client_zcml'])
+
+        uris = "zconfig:///etc/zodb_conf.xml#%s"
+        self.assertEqual(
+            buildout['zodb_uri_conf']['input'].splitlines()[1:],
+            ['[ZODB]',
+             'uris = ' + ' '.join(uris % name
+                                  for name in ('users_1', 'users_2', 'users_3', 'sessions')),
+             '',
+             '[shards:Users]',
+             'uris = ' + ' '.join(uris % name
+                                  for name in ('users_1', 'users_2', 'users_3'))])
+
+    def test_parse_storage_compress(self):
+        buildout = self.buildout
+        buildout['sessions_storage_opts'] = {
+            'compress': 'none',
+        }
+        buildout['archive_storage_opts'] = {
+            'compress': 'compress',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions Archive',
+        })
+        users = buildout['users_client']['client_zcml']
+        self.assertIn('compress false', users)
+        sessions = buildout['sessions_client']['client_zcml']
+        self.assertNotIn('zlibstorage', sessions)
+        self.assertNotIn('zlibstorage', buildout['sessions_storage']['server_zcml'])
+        archive = buildout['archive_client']['client_zcml']
+        self.assertIn('<zlibstorage>', archive)
+        self.assertNotIn('compress', archive.replace('zlibstorage', ''))
+
+    def test_parse_storage_compress_import(self):
+        buildout = self.buildout
+        buildout['users_storage_opts'] = {
+            'compress': 'compress',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+        })
+        self.assertIn('%import zc.zlibstorage', buildout['zodb_conf']['input'])
+        zeo_conf = buildout['base_zeo']['zeo.conf']
+        self.assertIn('%import zc.zlibstorage', zeo_conf)
+        self.assertIn('<serverzlibstorage 1>', zeo_conf)
+        self.assertNotIn('zlibstorage', buildout['sessions_client']['client_zcml'])
+
+        buildout = default_buildout()
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'none',
+        })
+        self.assertNotIn('zlibstorage', buildout['zodb_conf']['input'])
+
+    def test_parse_compress_on(self):
+        buildout = self.buildout
+        buildout['sessions_storage_opts'] = {
+            'compress-on': 'both',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'compress': 'compress',
+            'compress-on': 'server',
+        })
+        self.assertNotIn('zlibstorage', buildout['users_client']['client_zcml'])
+        self.assertIn('<zlibstorage 1>', buildout['users_storage']['server_zcml'])
+        self.assertIn('<zlibstorage>', buildout['sessions_client']['client_zcml'])
+        self.assertIn('<zlibstorage 2>', buildout['sessions_storage']['server_zcml'])
+        self.assertNotIn('serverzlibstorage', buildout['base_zeo']['zeo.conf'])
+        self.assertIn('%import zc.zlibstorage', buildout['zodb_conf']['input'])
+
+        buildout = default_buildout()
+        Databases(buildout, 'zeo', {
+            'storages': 'Users',
+            'compress-on': 'server',
+        })
+        self.assertNotIn('zlibstorage', buildout['zodb_conf']['input'])
+        self.assertIn('%import zc.zlibstorage', buildout['base_zeo']['zeo.conf'])
+
+    def test_parse_eventlog(self):
+        buildout = default_buildout(
+            deployment={'logrotate-directory': '/etc/logrotate.d'})
+        buildout['zeo_2_opts'] = {
+            'zeo-log-max-size': '100MB',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'zeo-servers': '2',
+            'zeo-log-level': 'WARNING',
+            'zeo-log-format': '%(message)s',
+            'zeo-logrotate': 'true',
+            'compress': 'none',
+        })
+        self.assertIn("""\
+<eventlog>
+    <logfile>
+      format %(message)s
+      level WARNING
+      path /var/log/zeo_1.log
+    </logfile>
+  level WARNING
+</eventlog>""", buildout['base_zeo_1']['zeo.conf'])
+        self.assertIn("""\
+    <logfile>
+      format %(message)s
+      level WARNING
+      max-size 100MB
+      old-files 5
+      path /var/log/zeo_2.log
+    </logfile>""", buildout['base_zeo_2']['zeo.conf'])
+
+        logrotate = buildout['base_zeo_1_logrotate']
+        self.assertEqual(logrotate['output'], '/etc/logrotate.d/zeo_1-eventlog')
+        self.assertIn('/var/log/zeo_1.log {', logrotate['input'])
+        self.assertNotIn('base_zeo_2_logrotate', buildout)
+
+    def test_parse_zodbconvert(self):
+        buildout = self.buildout
+        buildout['sessions_storage_opts'] = {
+            'zodbconvert-destination': 'sqlite3',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'write-zodbconvert': 'true',
+        })
+        users = buildout['users_zodbconvert_conf']
+        self.assertEqual(users['output'], '/etc/zodbconvert/users.xml')
+        self.assertEqual(users['input'], """\
+inline:
+
+<filestorage source>
+  blob-dir /data/Users.blobs
+  path /data/Users.fs
+  read-only true
+</filestorage>
+<filestorage destination>
+  blob-dir /data/zodbconvert/users/blobs
+  path /data/zodbconvert/users/data.fs
+</filestorage>""")
+        sessions = buildout['sessions_zodbconvert_conf']['input']
+        self.assertIn('%import relstorage', sessions)
+        self.assertIn('data-dir /data/zodbconvert/sessions', sessions)
+        self.assertIn('/data/zodbconvert/users/blobs', buildout['zeo_mkdirs']['paths'])
+
+        script = buildout['zeo_zodbconvert']
+        self.assertEqual(script['scripts'], 'zeo-zodbconvert')
+        self.assertIn(repr({
+            'name': 'Users',
+            'convert': {
+                'config': '/etc/zodbconvert/users.xml',
+                'blobs': ['/data/Users.blobs'],
+                'size': ['/data/zodbconvert/users/data.fs', '/data/zodbconvert/users/blobs'],
+            },
+        }), script['arguments'])
+
+    def test_parse_zodbconvert_bad_destination(self):
+        with self.assertRaises(UserError):
+            Databases(self.buildout, 'zeo', {
+                'storages': 'Users',
+                'write-zodbconvert': 'true',
+                'zodbconvert-destination': 'mysql',
+            })
+
+    def test_parse_zodbpack(self):
+        buildout = default_buildout(
+            deployment={'user': 'zope', 'crontab-directory': '/etc/cron.d'})
+        buildout['users_storage_opts'] = {
+            'pack-options': '--prepack',
+        }
+        Databases(buildout, 'zeo', {
+            'storages': 'Users Sessions',
+            'write-zodbpack': 'true',
+            'pack-days': '3',
+            'pack-weekdays': '6',
+        })
+        self.assertEqual(buildout['users_zodbpack_conf']['input'], """\
+inline:
+<zeoclient>
+  blob-dir /data/Users.blobs
+  name Users
+  server /var/zeosocket
+  shared-blob-dir true
+  storage 1
+</zeoclient>""")
+        zodbpack = buildout['buildout']['bin-directory'] + '/zodbpack'
+        self.assertEqual(buildout['zeo_zodbpack_crontab']['input'].splitlines()[2:], [
+            '0 1 * * 6 zope %s -d 3 --prepack /etc/zodbpack/users.xml' % zodbpack,
+            '0 3 * * 6 zope %s -d 3 /etc/zodbpack/sessions.xml' % zodbpack,
+        ])
+
+    def test_pack_start_times(self):
+        self.assertEqual(pack_start_times(4, '01:00-05:00'),
+                         [(1, 0), (2, 0), (3, 0), (4, 0)])
+        self.assertEqual(pack_start_times(3, '23:30-00:30'),
+                         [(23, 30), (23, 50), (0, 10)])
+        self.assertEqual(pack_start_times(2, '06:00-06:00'),
+                         [(6, 0), (18, 0)])
+        with self.assertRaises(UserError):
+            pack_start_times(1, '25:00-01:00')
+        with self.assertRaises(UserError):
+            pack_start_times(1, 'nightly')
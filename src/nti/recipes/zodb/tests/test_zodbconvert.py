@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+__docformat__ = "restructuredtext en"
+
+import io
+import os
+import stat
+import sys
+import unittest
+
+from hamcrest import assert_that
+from hamcrest import contains_string
+from hamcrest import is_
+
+from nti.recipes.zodb.zodbconvert import main
+from nti.recipes.zodb.zodbconvert import path_size
+
+from .test_files import _TempDirMixin
+
+# Records its arguments and writes a FileStorage
+FAKE_ZODBCONVERT = """\
+#!%(executable)s
+import os, sys
+config = sys.argv[-1]
+name = os.path.basename(config).split('_')[0]
+with open(os.path.join(os.path.dirname(config), 'calls'), 'a') as f:
+    f.write(' '.join([name] + sys.argv[1:-1]) + '\\n')
+with open(os.path.join(os.path.dirname(config), name + '.fs'), 'w') as f:
+    f.write('x' * 1024)
+print('Copied ' + name)
+sys.exit(1 if name == 'bad' else 0)
+"""
+
+
+class TestMain(_TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestMain, self).setUp()
+        self.zodbconvert = self._path('zodbconvert')
+        with open(self.zodbconvert, 'w') as f:
+            f.write(FAKE_ZODBCONVERT % {'executable': sys.executable})
+        os.chmod(self.zodbconvert, stat.S_IRWXU)
+
+    def _storage(self, name, blob_size=0):
+        blob_dir = self._path(name + '.blobs')
+        os.mkdir(blob_dir)
+        with open(os.path.join(blob_dir, 'blob'), 'w') as f:
+            f.write('b' * blob_size)
+        data_file = self._path(name + '.fs')
+        return {
+            'name': name,
+            'backup': {
+                'config': self._path(name + '_from_relstorage_conf.xml'),
+                'blobs': [blob_dir],
+                'size': [data_file],
+            },
+            'restore': {
+                'config': self._path(name + '_to_relstorage_conf.xml'),
+                'blobs': [data_file],
+                'size': [data_file],
+            },
+        }
+
+    def _main(self, storages, *argv):
+        output = io.StringIO() if str is not bytes else io.BytesIO()
+        result = main(storages, self.zodbconvert, argv=list(argv), output=output)
+        with open(self._path('calls')) as f:
+            calls = f.read().splitlines()
+        return result, calls, output.getvalue()
+
+    def test_backup(self):
+        storages = [self._storage('small', 10), self._storage('large', 1000)]
+        result, calls, output = self._main(storages, 'backup', '--jobs', '1', '--incremental')
+        assert_that(result, is_(0))
+        # Biggest first
+        assert_that(calls, is_(['large --incremental', 'small --incremental']))
+        assert_that(output, contains_string('[small] Copied small'))
+        assert_that(output, contains_string('[large] Finished in'))
+        assert_that(output, contains_string('[small] Finished in'))
+        assert_that(output, contains_string('Copied 2 storages'))
+        assert_that(path_size(self._path('small.fs')), is_(1024))
+
+    def test_restore_some(self):
+        storages = [self._storage('small'), self._storage('bad'), self._storage('other')]
+        result, calls, output = self._main(storages, 'restore', 'bad', 'small')
+        assert_that(result, is_(1))
+        assert_that(sorted(calls), is_(['bad', 'small']))
+        assert_that(output, contains_string('[bad] FAILED (1)'))
+        assert_that(output, contains_string('Failed: bad'))
@@ -9,12 +9,17 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+from zc.buildout import UserError
+
 from . import MultiStorageRecipe
 from . import deployment
 from . import serverzlibstorage
+from . import zlibstorage
 from . import filestorage
 from . import ZodbClientPart
 from . import zodb
+from . import _option_true
+from . import _option_count
 
 from ._model import hyphenated
 from ._model import Part
@@ -39,29 +44,38 @@ class BaseStoragePart(Part):
 
 class BaseClientPart(ZodbClientPart):
     client_zcml = None
+    zeo_cache_dir = hyphenated(Ref('deployment', 'cache-directory') / 'zeo')
+    zeo_address = Ref('deployment', 'run-directory') / 'zeosocket'
 
 class zeoclient(ZConfigSection):
     def __init__(self, **kwargs):
         ZConfigSection.__init__(self, 'zeoclient', None, **kwargs)
 
 class zeo(ZConfigSection):
-    def __init__(self, address):
+    def __init__(self, address, **kwargs):
         ZConfigSection.__init__(
             self, 'zeo', None,
-            address=address
+            address=address,
+            **kwargs
         )
 
+class logfile(ZConfigSection):
+    path = Ref('logFile')
+    format = "%(asctime)s %(message)s"
+    level = "DEBUG"
+
+    def __init__(self, **kwargs):
+        ZConfigSection.__init__(self, 'logfile', None, **kwargs)
+
 class eventlog(ZConfigSection):
-    def __init__(self):
-        logfile = ZConfigSection(
-            'logfile', None,
-            path=Ref('logFile'),
-            format="%(asctime)s %(message)s",
-            level="DEBUG",
-        )
+    def __init__(self, level=None, **kwargs):
+        eventlog_kwargs = {}
+        if level:
+            eventlog_kwargs['level'] = kwargs['level'] = level
         ZConfigSection.__init__(
             self,
-            'eventlog', None, logfile
+            'eventlog', None, logfile(**kwargs),
+            **eventlog_kwargs
         )
 
 class BaseZeoPart(Part):
@@ -72,52 +86,122 @@ class BaseZeoPart(Part):
     zeoConf = renamed('zeo.conf')
     deployment = 'deployment'
 
+def _nth_address(address, offset):
+    """
+    Return the address *offset* servers after *address*.
+
+    TCP addresses (``host:port`` or a port number) have *offset* added
+    to the port; Unix socket paths have it appended.
+    """
+    if not offset:
+        return address
+    host, _, port = address.rpartition(':')
+    if port.isdigit():
+        port = str(int(port) + offset)
+        return host + ':' + port if host else port
+    return '%s_%d' % (address, offset + 1)
+
 class Databases(MultiStorageRecipe):
     import_relstorage = ''
 
     def __init__(self, buildout, name, options):
         MultiStorageRecipe.__init__(self, buildout, name, options)
-        storages = options['storages'].split()
+        storages = self.storage_names()
         zeo_name = options.get('name', name)
 
-        # Order matters
-        base_storage_part = BaseStoragePart(
-            self._derive_related_part_name('base_storage'),
-            server_zcml=self.zlibstorage_wrapper(
+        recipe_compress_mode = self.needs_zlibstorage()
+        recipe_compress_on = self._compress_on(options.get)
+
+        def server_zcml(compress_mode='', compress_on=recipe_compress_on):
+            # serverzlibstorage leaves records as the clients send
+            # them; zlibstorage (de)compresses them in the server.
+            return self.zlibstorage_wrapper(
                 filestorage(
                     Ref('number'),
                     path=Ref('data_file'),
                     blob_dir=Ref("blob_dir"),
                     pack_gc=Ref("pack-gc").hyphenate()
                 ),
-                serverzlibstorage
+                serverzlibstorage if compress_on == 'client' else zlibstorage,
+                compress_mode
             )
+
+        # Order matters
+        base_storage_part = BaseStoragePart(
+            self._derive_related_part_name('base_storage'),
+            server_zcml=server_zcml()
         )
         self._parse(base_storage_part)
 
-        base_client_part = BaseClientPart(
-            self._derive_related_part_name('base_client'),
-            extends=(base_storage_part,),
-            storage_num=1,
-            client_zcml=zodb(
+        # With a shared blob directory, clients use the server's
+        # blob directory directly, so they have to be on the same host.
+        # Otherwise, each client keeps a cache of blobs it downloads.
+        shared_blob_dir = _option_true(options.get('shared-blob-dir', 'true'))
+        blob_cache_size = options.get('blob-cache-size', '')
+        client_kwargs = {}
+        zeoclient_kwargs = {}
+        if not shared_blob_dir:
+            client_kwargs['blob_cache_dir'] = (
+                Ref('deployment', 'cache-directory') / Ref('name') + '.blobs'
+            )
+            if blob_cache_size:
+                client_kwargs['blob_cache_size'] = hyphenated(blob_cache_size)
+                zeoclient_kwargs['blob_cache_size'] = hyphenated(
+                    self.ref('blob-cache-size'))
+
+        zodb_kwargs, zodb_part_kwargs = self.optional_zodb_settings(
+            [name + '_opts'] + [
+                opts_name
+                for storage in storages
+                for suffix in ('_storage_opts', '_client_opts')
+                for opts_name in self.storage_opts_names('', storage, suffix)
+            ])
+        client_kwargs.update(zodb_part_kwargs)
+
+        def client_zcml(compress_mode='', compress_on=recipe_compress_on, **kwargs):
+            kwargs.update(zeoclient_kwargs)
+            if compress_on == 'server':
+                compress_mode = None
+            return zodb(
                 Ref('name'),
                 self.zlibstorage_wrapper(
                     zeoclient(
-                        server=BaseZeoPart.clientPipe,
-                        shared_blob_dir=hyphenated(True),
-                        blob_dir=hyphenated(self.ref('blob_dir')),
+                        server=self.ref('zeo_address'),
+                        shared_blob_dir=hyphenated(shared_blob_dir),
+                        blob_dir=hyphenated(self.ref(
+                            'blob_dir' if shared_blob_dir else 'blob_cache_dir')),
                         storage=self.ref('storage_num'),
                         name=self.ref('name'),
-                    )
-                )
+                        **kwargs
+                    ),
+                    compress_mode=compress_mode
+                ),
+                **zodb_kwargs
             )
+
+        pool_plan = self.planned_pool_settings()
+        base_client_part = BaseClientPart(
+            self._derive_related_part_name('base_client'),
+            extends=(base_storage_part,),
+            storage_num=1,
+            client_zcml=client_zcml(),
+            **client_kwargs
         )
-        base_client_part.buildout_lookup = self.make_buildout_lookup([base_storage_part, options])
+        base_client_part.buildout_lookup = self.make_buildout_lookup(
+            [pool_plan, base_storage_part, options])
+        if pool_plan:
+            base_client_part.add_default('pool_size', pool_plan['pool_size'])
 
         self._parse(base_client_part)
-        server_zcml_names = []
+        zeo_servers = self._zeo_servers(zeo_name)
+        server_zcml_names = {server[0]: [] for server in zeo_servers}
+        server_compress_modes = {server[0]: [] for server in zeo_servers}
         zodb_file_uris = []
         client_parts = []
+        write_zodbconvert = _option_true(options.get('write-zodbconvert', 'false'))
+        zodbconvert_storages = []
+        write_zodbpack = _option_true(options.get('write-zodbpack', 'false'))
+        zodbpack_storages = []
 
         base_file_uri = ("zlibfile://${%(part)s:data_file}"
                          "?database_name=${%(part)s:name}"
@@ -132,18 +216,39 @@ class Databases(MultiStorageRecipe):
             # storages begin at 1
             i = i + 1
             storage_part_name = storage.lower() + '_storage'
+            # A shard's group _opts come before its own.
+            storage_opts_names = self.storage_opts_names('', storage, '_storage_opts')
+            client_opts_names = self.storage_opts_names('', storage, '_client_opts')
             storage_part_extends = [
                 base_storage_part,
                 self.my_options_base_name,
                 buildout.get(name + '_opts'),
-                buildout.get(storage_part_name + '_opts'),
-            ]
+            ] + [buildout.get(opts_name) for opts_name in storage_opts_names]
+            zeo_part_name, _, client_address = self._zeo_server_for_storage(
+                zeo_servers, i,
+                self.storage_opts('', storage, '_storage_opts'))
+            compress_mode = self.storage_compress_mode(
+                [name + '_opts'] + storage_opts_names)
+            compress_on = self._compress_on(self.make_buildout_lookup([
+                self.my_options_base_name,
+                name + '_opts',
+            ] + storage_opts_names))
+            compress = (compress_mode, compress_on)
+            server_compress_modes[zeo_part_name].append(compress_mode)
+            self._client_compress_modes.append(
+                None if compress_on == 'server' else compress_mode)
+            storage_part_kwargs = {}
+            if compress != (recipe_compress_mode, recipe_compress_on):
+                # Clients and servers must agree, so this is
+                # configured for the storage, not the client.
+                storage_part_kwargs['server_zcml'] = server_zcml(*compress)
             storage_part = Part(
                 storage_part_name,
                 extends=storage_part_extends,
                 name=storage,
                 number=i,
-                pack_gc=hyphenated(options.get('pack-gc', False))
+                pack_gc=hyphenated(options.get('pack-gc', False)),
+                **storage_part_kwargs
             )
             self._parse(storage_part)
 
@@ -155,35 +260,124 @@ class Databases(MultiStorageRecipe):
                 # the desired (high) precedence.
                 self.my_options_base_name,
                 buildout.get(name + '_opts'),
-                buildout.get(storage_part_name + '_opts'),
-                buildout.get(client_part_name + '_opts'),
+            ] + [
+                buildout.get(opts_name)
+                for opts_name in storage_opts_names + client_opts_names
             ]
+            client_lookup = self.make_buildout_lookup([
+                self.my_options_base_name,
+                name + '_opts',
+            ] + storage_opts_names + client_opts_names)
+            client_cache_kwargs = self._client_cache_settings(storage, client_lookup)
+            if not shared_blob_dir and not blob_cache_size and client_lookup('blob-cache-size'):
+                # Without a recipe-wide size, the base client has
+                # none to share.
+                client_cache_kwargs['blob_cache_size'] = hyphenated(
+                    self.ref('blob-cache-size'))
+            client_part_kwargs = {}
+            if client_cache_kwargs or compress != (recipe_compress_mode, recipe_compress_on):
+                # Only clients that use these settings get their own
+                # ZCML; the rest share the base client's.
+                client_part_kwargs['client_zcml'] = client_zcml(*compress,
+                                                                **client_cache_kwargs)
             client_part = Part(
                 client_part_name,
                 extends=client_part_extends,
                 name=storage,
                 storage_num=i,
+                zeo_address=client_address or Ref(zeo_part_name, 'clientPipe'),
+                **client_part_kwargs
             )
+            if 'client_zcml' in client_part_kwargs:
+                # Rendering its own <zodb>, this part needs the
+                # defaults the base client has, and its own _opts.
+                client_part.buildout_lookup = self.make_buildout_lookup([
+                    pool_plan,
+                    base_storage_part,
+                    options,
+                    self.my_options_base_name,
+                    name + '_opts',
+                ] + storage_opts_names + client_opts_names)
+                # Its pool_size default is written in its own section,
+                # so it must be the value it would otherwise inherit
+                # (the plan's, or an explicit one), not ZODB's.
+                pool_size = client_part.buildout_lookup('pool_size')
+                if pool_size is not None:
+                    client_part.add_default('pool_size', pool_size)
             client_parts.append(client_part)
+            if 'var' in client_cache_kwargs:
+                self.create_directory(client_part.name, 'zeo-cache-dir')
 
             self.create_directory(storage_part.name, 'blob_dir')
+            if not shared_blob_dir:
+                self.create_directory(client_part.name, 'blob_cache_dir')
             self.add_database(client_part.name, 'client_zcml')
+            self.add_manifest_config(storage, client_part.name, 'client_zcml')
+            self.add_manifest_config(storage, storage_part.name, 'server_zcml')
 
-            server_zcml_names.append(storage_part['server_zcml'].ref())
+            server_zcml_names[zeo_part_name].append(storage_part['server_zcml'].ref())
             zodb_file_uris.append(base_file_uri % {'part': client_part.name})
+            storage_lookup = self.make_buildout_lookup([
+                self.my_options_base_name,
+                name + '_opts',
+            ] + storage_opts_names)
+            if write_zodbconvert:
+                zodbconvert_storages.append(
+                    self._create_zodbconvert_parts(storage_part, storage_lookup))
+            if write_zodbpack:
+                # The server packs (and collects garbage, according
+                # to pack-gc) when a client asks it to; a client
+                # doesn't need to decompress anything for that.
+                zodbpack_storages.append((
+                    storage,
+                    [zeoclient(
+                        server=Ref(client_part.name, 'zeo_address'),
+                        storage=Ref(client_part.name, 'storage_num'),
+                        name=Ref(client_part.name, 'name'),
+                        shared_blob_dir=hyphenated(shared_blob_dir),
+                        blob_dir=hyphenated(Ref(
+                            client_part.name,
+                            'blob_dir' if shared_blob_dir else 'blob_cache_dir')),
+                    )],
+                    zeo_part_name,
+                    storage_lookup,
+                ))
 
-        base_zeo_part = BaseZeoPart(
-            'base_zeo',
-            name=zeo_name,
-            zeoConf=[
-                self.zlibstorage_import(),
-                zeo(self.ref('clientPipe')),
-            ] + server_zcml_names + [
-                eventlog(),
-            ],
-        )
-
-        self._parse(base_zeo_part)
+        for zeo_part_name, zeo_settings, _ in zeo_servers:
+            storage_zcml_names = server_zcml_names[zeo_part_name]
+            if not storage_zcml_names:
+                # Nothing to serve; zc.zodbrecipes refuses to
+                # create such a server.
+                continue
+            server_lookup = self.make_buildout_lookup([
+                self.my_options_base_name,
+                name + '_opts',
+                zeo_settings['name'] + '_opts',
+            ])
+            server_settings = self._server_settings(server_lookup)
+            eventlog_kwargs, logrotate = self._eventlog_settings(server_lookup)
+            zeo_part = BaseZeoPart(
+                zeo_part_name,
+                zeoConf=[
+                    self.zlibstorage_import(server_compress_modes[zeo_part_name]),
+                    zeo(self.ref('clientPipe'), **server_settings),
+                ] + storage_zcml_names + [
+                    eventlog(**eventlog_kwargs),
+                ],
+                **zeo_settings
+            )
+            if logrotate:
+                self._parse_file(Part(
+                    zeo_part_name + '_logrotate',
+                    recipe=self.file_recipe,
+                    output=(Ref('deployment', 'logrotate-directory')
+                            / (zeo_settings['name'] + '-eventlog')),
+                    input=['inline:'] + self.logrotate_template(
+                        Ref(zeo_part_name, 'logFile')),
+                ))
+            self._parse(zeo_part)
+            self.add_manifest_config(zeo_settings['name'], zeo_part_name, 'zeo.conf',
+                                     kind='server')
 
         for client in client_parts:
             # We'd like for users to be able to override
@@ -204,9 +398,9 @@ class Databases(MultiStorageRecipe):
         self.buildout_add_zodb_conf()
         self.buildout_add_zeo_uris()
 
-        self._parse(Part(
+        self._parse_file(Part(
             'zodb_direct_file_uris_conf',
-            recipe='collective.recipe.template',
+            recipe=self.file_recipe,
             output=deployment.etc / 'zodb_file_uris.ini',
             input=[
                 'inline:',
@@ -215,4 +409,258 @@ class Databases(MultiStorageRecipe):
             ]
         ))
 
+        if write_zodbconvert:
+            self.buildout_add_zodbconvert_script(zodbconvert_storages)
+        if write_zodbpack:
+            self.buildout_add_zodbpack(zodbpack_storages)
+
         self.buildout_add_mkdirs()
+        self.buildout_add_manifest()
+        self.parse_pending_parts()
+
+    #: The values of ``zodbconvert-destination``.
+    zodbconvert_destinations = ('filestorage', 'sqlite3')
+
+    def _create_zodbconvert_parts(self, storage_part, lookup):
+        """
+        Add the parts for the configuration that copies the storage of
+        *storage_part* to a new storage with ``zodbconvert``, and return
+        the mapping describing it to :mod:`nti.recipes.zodb.zodbconvert`.
+
+        The records are copied as they are, so a compressed storage
+        stays compressed.
+        """
+        destination = lookup('zodbconvert-destination') or 'filestorage'
+        if destination not in self.zodbconvert_destinations:
+            raise UserError(
+                "Invalid zodbconvert-destination %r for %s; choose from %s" % (
+                    destination, storage_part['name'],
+                    ', '.join(self.zodbconvert_destinations)))
+
+        normalized_storage_name = storage_part['name'].lower()
+        zodbconvert_dir = (self.my_options.get('zodbconvert-dir')
+                           or Ref('deployment', 'data-directory') / 'zodbconvert')
+        if destination == 'sqlite3':
+            destination_zcml = ZConfigSection(
+                'relstorage', 'destination',
+                ZConfigSection('sqlite3', None,
+                               data_dir=Ref('dump_dir').hyphenate()),
+                blob_dir=Ref('blob_dump_dir').hyphenate(),
+                shared_blob_dir=hyphenated(True),
+                keep_history=hyphenated(False),
+            )
+        else:
+            destination_zcml = filestorage('destination')
+
+        convert_part = Part(
+            'zodbconvert_' + storage_part.name,
+            extends=(storage_part,),
+            zodbconvert_dir=zodbconvert_dir,
+            dump_dir=Ref('zodbconvert_dir') / normalized_storage_name,
+            blob_dump_dir=Ref('dump_dir') / 'blobs',
+            source_zcml=filestorage(
+                'source',
+                path=Ref('data_file'),
+                blob_dir=Ref('blob_dir').hyphenate(),
+                read_only=hyphenated(True),
+            ),
+            destination_zcml=destination_zcml,
+        )
+        self._parse(convert_part)
+        self.create_directory(convert_part.name, 'dump_dir')
+        self.create_directory(convert_part.name, 'blob_dump_dir')
+
+        conf_part = Part(
+            normalized_storage_name + '_zodbconvert_conf',
+            recipe=self.file_recipe,
+            output=Ref('deployment', 'etc-directory') / 'zodbconvert'
+            / (normalized_storage_name + '.xml'),
+            input=[
+                'inline:',
+                '%import relstorage' if destination == 'sqlite3' else '',
+                Ref(convert_part.name, 'source_zcml'),
+                Ref(convert_part.name, 'destination_zcml'),
+            ],
+        )
+        self._parse_file(conf_part)
+
+        if destination == 'sqlite3':
+            size = [str(Ref(convert_part.name, 'dump_dir'))]
+        else:
+            size = [str(Ref(convert_part.name, 'dump_dir')) + '/data.fs',
+                    str(Ref(convert_part.name, 'blob_dump_dir'))]
+        return {
+            'name': str(Ref(storage_part.name, 'name')),
+            'convert': {
+                'config': str(Ref(conf_part.name, 'output')),
+                'blobs': [str(Ref(storage_part.name, 'blob_dir'))],
+                'size': size,
+            },
+        }
+
+    def _zeo_servers(self, zeo_name):
+        """
+        Return ``(part_name, settings, client_address)`` for each
+        ``zc.zodbrecipes:server`` part, according to the number of
+        servers in ``zeo-servers``.
+
+        The server listens on ``zeo-address`` if that's given, and
+        otherwise on a Unix socket in the run directory. Clients
+        connect to ``zeo-client-address``, if given, or the address
+        the server listens on (in which case *client_address* is
+        None). When there are several servers, they use consecutive
+        ports.
+
+        A single server keeps the historical names.
+        """
+        options = self.my_options
+        count = _option_count(options.get('zeo-servers') or '1', 'zeo-servers')
+        address = options.get('zeo-address')
+        client_address = options.get('zeo-client-address')
+
+        run_dir = Ref('deployment', 'run-directory')
+        log_dir = Ref('deployment', 'log-directory')
+        servers = []
+        for number in range(1, count + 1):
+            if count == 1:
+                part_name = 'base_zeo'
+                settings = {'name': zeo_name}
+            else:
+                part_name = 'base_zeo_%d' % number
+                settings = {
+                    'name': '%s_%d' % (zeo_name, number),
+                    'clientPipe': run_dir / ('zeosocket_%d' % number),
+                    'logFile': log_dir / ('zeo_%d.log' % number),
+                }
+            if address:
+                settings['clientPipe'] = _nth_address(address, number - 1)
+            servers.append((
+                part_name,
+                settings,
+                _nth_address(client_address, number - 1) if client_address else None,
+            ))
+        return servers
+
+    #: Settings for the ZEO server that are copied to its ``<zeo>``
+    #: section when set.
+    server_settings = (
+        'invalidation-queue-size',
+        'invalidation-age',
+        'transaction-timeout',
+        'msgpack',
+        'read-only',
+    )
+
+    def _server_settings(self, lookup):
+        """
+        Return the keyword arguments for a server's ``<zeo>``
+        section, as found by *lookup*.
+        """
+        kwargs = {}
+        for setting in self.server_settings:
+            value = lookup(setting)
+            if value:
+                kwargs[setting.replace('-', '_')] = hyphenated(value)
+        return kwargs
+
+    #: The number of old log files kept by default when the event
+    #: log is rotated by size.
+    log_old_files = 5
+
+    def _eventlog_settings(self, lookup):
+        """
+        Return the keyword arguments for a server's :class:`eventlog`,
+        as found by *lookup*, and whether to write a logrotate
+        configuration for it.
+        """
+        kwargs = {}
+        level = lookup('zeo-log-level')
+        if level:
+            # Also set on the logger, so that messages below
+            # the level aren't even created.
+            kwargs['level'] = level
+        log_format = lookup('zeo-log-format')
+        if log_format:
+            kwargs['format'] = log_format
+        max_size = lookup('zeo-log-max-size')
+        logrotate = _option_true(lookup('zeo-logrotate'))
+        if max_size:
+            kwargs['max_size'] = hyphenated(max_size)
+            kwargs['old_files'] = hyphenated(lookup('zeo-log-old-files') or self.log_old_files)
+            if logrotate:
+                logger.warning("The ZEO event log is rotated by size; "
+                               "not writing a logrotate configuration.")
+                logrotate = False
+        return kwargs, logrotate
+
+    @staticmethod
+    def logrotate_template(log_file):
+        """
+        Return the lines of a logrotate configuration for *log_file*.
+
+        The file is truncated in place, so the server doesn't have to be
+        told to reopen it.
+        """
+        return [
+            log_file + ' {',
+            '  rotate 5',
+            '  weekly',
+            '  compress',
+            '  delaycompress',
+            '  missingok',
+            '  notifempty',
+            '  copytruncate',
+            '}',
+        ]
+
+    #: Settings for the ZEO client cache, and the ``<zeoclient>``
+    #: keys they set.
+    client_cache_settings = (
+        ('zeo-cache-size', 'cache-size'),
+        ('drop-cache-rather-verify', 'drop-cache-rather-verify'),
+        ('wait', 'wait'),
+    )
+
+    def _client_cache_settings(self, storage, lookup):
+        """
+        Return the keyword arguments for the ``<zeoclient>`` of
+        *storage* that configure its cache, as found by *lookup*.
+
+        If ``zeo-cache-persistent`` is true, the cache is kept in a
+        file named for ``zeo-cache-client`` (by default, the storage
+        name) in ``zeo-cache-dir`` (by default, ``zeo`` in the
+        ``cache-directory``).
+        """
+        kwargs = {}
+        for setting, key in self.client_cache_settings:
+            value = lookup(setting)
+            if value:
+                kwargs[key.replace('-', '_')] = hyphenated(value)
+        if _option_true(lookup('zeo-cache-persistent')):
+            kwargs['client'] = lookup('zeo-cache-client') or storage
+            kwargs['var'] = hyphenated(self.ref('zeo-cache-dir'))
+        return kwargs
+
+    #: Where the records of compressing storages can be compressed.
+    compress_on_choices = ('client', 'server', 'both')
+
+    def _compress_on(self, lookup):
+        compress_on = (lookup('compress-on') or 'client').lower()
+        if compress_on not in self.compress_on_choices:
+            raise UserError("Invalid compress-on %r; choose from %s" % (
+                compress_on, ', '.join(self.compress_on_choices)))
+        return compress_on
+
+    @staticmethod
+    def _zeo_server_for_storage(zeo_servers, number, storage_opts):
+        # The ``zeo-server`` setting in the storage's _opts part
+        # picks a server (counting from 1); otherwise storages are
+        # assigned to servers in turn.
+        server = storage_opts.get('zeo-server')
+        if server:
+            server = _option_count(server, 'zeo-server')
+            if server > len(zeo_servers):
+                raise UserError("zeo-server %d is not one of the %d zeo-servers" % (
+                    server, len(zeo_servers)))
+            return zeo_servers[server - 1]
+        return zeo_servers[(number - 1) % len(zeo_servers)]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run ``zodbconvert`` for many storages at once.
+
+The ``write-zodbconvert`` option of the recipes writes configuration
+files for each storage. For RelStorage, one copies it to a FileStorage
+(a backup), and one copies that back (a restore); for ZEO, one copies
+the FileStorage to a new storage. This module provides the console
+script generated along with them. It runs ``zodbconvert`` for the
+storages with a bounded number of processes, starting with the
+storages that have the most blob data, so that the whole run takes
+about as long as the largest storage.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+def path_size(path):
+    """
+    Return the size in bytes of the file at *path*, or of all the
+    files in the directory at *path*. Missing paths have no size.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError: # pragma: no cover
+                # Removed while we were looking.
+                pass
+    return total
+
+def _format_size(size):
+    return '%.1f MB' % (size / 1024.0 / 1024.0)
+
+
+class Conversion(object):
+    """
+    One run of ``zodbconvert`` for a storage.
+
+    *storage* is a mapping as given to :func:`main`.
+    """
+
+    def __init__(self, storage, direction, command, output, lock):
+        self.name = storage['name']
+        self.conversion = storage[direction]
+        self.command = list(command) + [self.conversion['config']]
+        self.output = output
+        self.lock = lock
+        self.returncode = None
+        self.elapsed = 0
+        self.size = 0
+
+    def blob_size(self):
+        return sum(path_size(path) for path in self.conversion['blobs'])
+
+    def _print(self, message):
+        with self.lock:
+            print('[%s] %s' % (self.name, message), file=self.output)
+            self.output.flush()
+
+    def __call__(self):
+        self._print('Starting: %s' % ' '.join(self.command))
+        begin = time.time()
+        process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        for line in iter(process.stdout.readline, ''):
+            self._print(line.rstrip())
+        process.stdout.close()
+        self.returncode = process.wait()
+        self.elapsed = time.time() - begin
+        self.size = sum(path_size(path) for path in self.conversion['size'])
+        self._print('%s in %.1fs: %s, %s/s' % (
+            'Finished' if self.returncode == 0 else 'FAILED (%s)' % self.returncode,
+            self.elapsed,
+            _format_size(self.size),
+            _format_size(self.size / self.elapsed if self.elapsed else 0)))
+        return self
+
+
+def main(storages, zodbconvert='zodbconvert', argv=None, output=None):
+    """
+    Run ``zodbconvert`` for *storages*.
+
+    *storages* is a sequence of mappings, one for each storage. The
+    key ``name`` is the storage's name. The other keys are the
+    directions it can be converted in (such as ``backup``), and map
+    to a mapping with the keys ``config`` (the configuration file),
+    ``blobs`` (the paths of the blobs to be copied, used to order the
+    conversions) and ``size`` (the paths whose size, after the
+    conversion, is what was copied). *zodbconvert* is the path to
+    that script. Command line arguments come from *argv*, by default
+    ``sys.argv[1:]``.
+
+    Returns the exit status.
+    """
+    output = output or sys.stdout
+    parser = argparse.ArgumentParser(
+        description="Copy storages with zodbconvert in parallel.")
+    directions = sorted(set(
+        key
+        for storage in storages
+        for key in storage
+        if key != 'name'
+    ))
+    parser.add_argument(
+        'direction', choices=directions,
+        help="For RelStorage, backup copies to FileStorage; restore copies back. "
+        "For ZEO, convert copies to a new storage.")
+    parser.add_argument(
+        'names', nargs='*', metavar='storage',
+        help="The storages to copy. Default: all of them.")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+        help="How many conversions to run at once. Default: %(default)s")
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help="Only copy transactions newer than the destination has.")
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help="Passed to zodbconvert.")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    known = [storage['name'] for storage in storages]
+    unknown = sorted(set(args.names) - set(known))
+    if unknown:
+        parser.error('Unknown storages: %s. Choose from: %s' % (
+            ' '.join(unknown), ' '.join(known)))
+
+    command = [zodbconvert]
+    if args.incremental:
+        command.append('--incremental')
+    if args.dry_run:
+        command.append('--dry-run')
+
+    lock = threading.Lock()
+    conversions = [
+        Conversion(storage, args.direction, command, output, lock)
+        for storage in storages
+        if (not args.names or storage['name'] in args.names)
+        and args.direction in storage
+    ]
+    # The storages with the most blob data take the longest;
+    # start them first so they don't hold up the end of the run.
+    sizes = {conversion.name: conversion.blob_size() for conversion in conversions}
+    conversions.sort(key=lambda conversion: -sizes[conversion.name])
+
+    begin = time.time()
+    pool = ThreadPool(max(1, min(args.jobs, len(conversions) or 1)))
+    try:
+        results = pool.map(lambda conversion: conversion(), conversions)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - begin
+
+    failed = [conversion.name for conversion in results if conversion.returncode]
+    total = sum(conversion.size for conversion in results)
+    print('Copied %d storages in %.1fs: %s, %s/s' % (
+        len(results), elapsed, _format_size(total),
+        _format_size(total / elapsed if elapsed else 0)), file=output)
+    if failed:
+        print('Failed: %s' % ' '.join(failed), file=output)
+        return 1
+    return 0